@@ -7,31 +7,75 @@ Patrick Lavallee Delgado
 University of Chicago, CS & Harris MSCAPP '20
 Tuesday April 9, 2019
 
-Notes:
-1. Fix SettingWithCopyWarning in join_crime_with_block_groups().
-2. Generalize SOAP API parameters functions into one.
-3. Generalize SOAP API request functions into one.
-
 '''
 
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import reduce
+from itertools import islice
+import argparse
+import cProfile
+import glob
+import hashlib
+import importlib
 import json
+import os
 import re
-import requests
+import resource
+import shutil
 import sys
-import geopandas as gpd
-import matplotlib
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-from shapely.geometry import Point, shape
-from shapely.ops import unary_union
-import shapely.wkt
+import tempfile
+import threading
+import time
+import tracemalloc
 from tabulate import tabulate
 
+
+class LazyModule:
+
+    '''
+    Stand in for a module until one of its attributes is first used, then
+    import it, so that each stage pays only for the dependencies it needs.
+
+    '''
+
+    def __init__(self, name):
+
+        self._name = name
+
+
+    def __getattr__(self, attribute):
+
+        module = importlib.import_module(self._name)
+        self.__dict__.update(vars(module))
+        return getattr(module, attribute)
+
+
+gpd = LazyModule("geopandas")
+matplotlib = LazyModule("matplotlib")
+plt = LazyModule("matplotlib.pyplot")
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+pa = LazyModule("pyarrow")
+pq = LazyModule("pyarrow.parquet")
+requests = LazyModule("requests")
+shapely = LazyModule("shapely")
+
 COMMUNITY_AREAS_API = "https://data.cityofchicago.org/resource/igwz-8jzy.json"
 CENSUS_BLOCKS_API = "https://data.cityofchicago.org/resource/bt9m-d2mf.json"
 CRIME_DATA_API = "https://data.cityofchicago.org/resource/6zsd-86xi.json"
-ACS_API = "https://api.census.gov/data/2017/acs/acs5"
+ACS_API = "https://api.census.gov/data/{year}/acs/{dataset}"
+ACS_YEAR = 2017
+ACS_DATASET = "acs5"
+ACS_VINTAGES = list(range(2013, 2020)) # on 2010 block group boundaries
+
+SOAP_PAGE_SIZE = 1000
+SOAP_MAX_WORKERS = 8
+SOAP_MAX_RETRIES = 3
+SOAP_BACKOFF_SECONDS = 0.5
+SOAP_TIMEOUT_SECONDS = 60 # to connect, and between bytes of a response
+SOAP_RETRY_STATUS = {429, 500, 502, 503, 504}
 
 ACS_RACE = {
     "B03002_001E": "race_respondents", # total population
@@ -70,552 +114,3334 @@ ACS_HOUSEHOLD_INCOME = {
 
 ACS_VARIABLES = [ACS_RACE, ACS_EDUCATION, ACS_HOUSEHOLD_INCOME]
 
-COMMUNITY_AREAS_CSV = "chicago-community-areas.csv"
-CENSUS_BLOCK_GROUPS_CSV = "chicago-block-groups.csv"
-CHICAGO_CRIME_CSV = "chicago-crime.csv"
-CENSUS_DATA_CSV = "cook-county-acs5-2017.csv"
+GEOMETRY_BUNDLE = "chicago-geometry"
+COMMUNITY_AREAS_PARQUET = os.path.join(GEOMETRY_BUNDLE, "community-areas.parquet")
+BLOCK_GROUPS_PARQUET = os.path.join(GEOMETRY_BUNDLE, "block-groups.parquet")
+CHICAGO_CRIME_STORE = "chicago-crime"
+CHICAGO_CRIME_MANIFEST = "manifest.json"
+CENSUS_DATA_CACHE = "cook-county-acs"
+GEOCODE_CACHE = "chicago-geocode"
+PLOT_MANIFEST = "chicago-plots.json"
+DATA_SNAPSHOT_CACHES = [
+    GEOMETRY_BUNDLE, CHICAGO_CRIME_STORE, CENSUS_DATA_CACHE, GEOCODE_CACHE]
+DATA_SNAPSHOT_MANIFEST = "snapshot.json"
+
+# Bump whenever the layout or types of a cache change to rebuild stale caches.
+CACHE_SCHEMA_VERSION = 2
+CRIME_ROW_GROUP_SIZE = 2048
+CRIME_UPSERT_BATCH_ROWS = 100000
+
+CRIME_SCHEMA = {
+    "id": "int64",
+    "case_number": "object",
+    "date": "datetime64[ns]",
+    "block": "object",
+    "iucr": "object",
+    "primary_type": "object",
+    "description": "object",
+    "location_description": "object",
+    "arrest": "bool",
+    "domestic": "bool",
+    "beat": "object",
+    "district": "object",
+    "ward": "object",
+    "community_area": "object",
+    "fbi_code": "object",
+    "x_coordinate": "float64",
+    "y_coordinate": "float64",
+    "year": "int16",
+    "updated_on": "datetime64[ns]",
+    "latitude": "float64",
+    "longitude": "float64",
+    "block_group": "object"}
+
+BLOCK_JOIN_CHUNK_SIZE = 250000
+BOUNDS_COLUMNS = ["minx", "miny", "maxx", "maxy"]
+GEOMETRY_SIMPLIFY_TOLERANCE = None # degrees, or None to keep every vertex
+GEOCODE_PRECISION = 6
+
+BlockGroupIndex = namedtuple(
+    "BlockGroupIndex", ["tree", "block_groups", "bounds", "version"])
+CrimeAnalysis = namedtuple(
+    "CrimeAnalysis",
+    ["year_min", "year_max", "crime_data", "time_index", "crime_cubes",
+        "census_data", "block_index"])
+CrimeIdIndex = namedtuple("CrimeIdIndex", ["ids", "partitions", "paths"])
+CrimeTimeIndex = namedtuple(
+    "CrimeTimeIndex",
+    ["dates", "weekdays", "hours", "weekday_order", "weekday_offsets",
+        "hour_order", "hour_offsets"])
+TimeWindow = namedtuple(
+    "TimeWindow", ["start", "end", "months", "weekdays", "hours"],
+    defaults=[None] * 5)
+CommunityIndex = namedtuple(
+    "CommunityIndex", ["communities", "by_area", "block_groups", "by_block_group"])
+
+CRIME_CUBE_DIMENSIONS = [
+    "year", "month", "week", "primary_type", "community", "block_group"]
+CRIME_CUBE_ROLLUPS = {
+    "months": ["year", "month", "primary_type", "community"],
+    "weeks": ["week", "primary_type"],
+    "blocks": ["year", "primary_type", "community", "block_group"]}
+CRIME_PARTITION_CODES = ["primary_type", "community", "block_group"]
+CRIME_CUBE_PARALLEL_MIN_ROWS = 1000000
+CRIME_CUBE_MERGE_ROWS = 1000000
+
+CRIME_COMPACT_SCHEMA = {
+    "date": "datetime64[ns]",
+    "year": "int16",
+    "primary_type": "category",
+    "description": "category",
+    "location_description": "category",
+    "iucr": "category",
+    "fbi_code": "category",
+    "beat": "category",
+    "district": "category",
+    "ward": "category",
+    "block": "category",
+    "community_area": "category",
+    "community": "category",
+    "block_group": "category",
+    "x_coordinate": "float32",
+    "y_coordinate": "float32",
+    "latitude": "float64",
+    "longitude": "float64"}
+
+CRIME_REPORT_COLUMNS = [
+    "id", "date", "year", "primary_type", "community_area", "block_group"]
+
+def summarize_crime(year_min, year_max, crimes, k_most, demo_from_csv=False, \
+    report=True, plot=True, max_workers=1, out_of_core=False):
+
+    trace = PIPELINE_TRACE
+    analysis = compile_crime_analysis(year_min, year_max, demo_from_csv, \
+        max_workers, out_of_core)
+    crime_cubes = analysis.crime_cubes
+    census_data = analysis.census_data
+    block_index = analysis.block_index
 
-def summarize_crime(year_min, year_max, crimes, k_most, demo_from_csv=False):
-
-    communities = compile_community_areas()
-    blocks = compile_block_groups(demo_from_csv)
-    crime_data = compile_crime_data(year_min, year_max, communities, blocks, demo_from_csv)
-    census_data = compile_census_data(ACS_VARIABLES, demo_from_csv)
+    # Plot incidence trends of interesting crimes.
+    if plot:
+        with trace.stage("report: trends of crime incidence"):
+            plot_trends_of_crime_incidence(crime_cubes["weeks"], year_min, \
+                year_max, crimes)
+    if not report:
+        return
+    crime_report = CrimeReport()
 
     # Calculate summary statistics with interesting variables.
-    print("#### Summary statistics \n")
-    describe_change_overall(crime_data, year_min, year_max)
-    print("\n")
-    interesting_variables = ["primary_type", "community"]
-    for variable in interesting_variables:
-        describe_change_in_variable(crime_data, year_min, year_max, variable)
-        print("\n")
-
-    # Plot incidence trends of interesting crimes.
-    for crime in crimes:
-        plot_trend_of_crime_incidence(crime_data, year_min, year_max, crime)
-        print("\n")
+    with trace.stage("report: summary statistics"):
+        crime_report.add_section("Summary statistics")
+        describe_change_overall(crime_cubes["months"], year_min, year_max, \
+            crime_report)
+        crime_report.add("\n")
+        interesting_variables = ["primary_type", "community"]
+        for variable in interesting_variables:
+            describe_change_in_variable(crime_cubes["months"], year_min, \
+                year_max, variable, crime_report)
+            crime_report.add("\n")
+
+    if plot:
+        crime_report.add("\n")
 
     # Identify the k blocks with highest incidence of interesting crimes.
-    print("#### Descriptive statistics \n")
-    for crime in crimes:
-        print(
-            "#### " + crime.upper() + "\n")
-        for k in range(k_most):
-            describe_block_with_kth_most_crime(crime_data, census_data, \
-                year_min, year_max, crime, k)
-            print("\n")
+    with trace.stage("report: blocks with most crime"):
+        crime_report.add_section("Descriptive statistics")
+        for crime in crimes:
+            crime_report.add_section(crime.upper())
+            describe_blocks_with_most_crime(crime_cubes["blocks"], \
+                census_data, year_min, year_max, crime, k_most, crime_report)
 
     # Refuting Jacob Ringer
-    print("#### Refuting Jacob Ringer \n")
-    for_ringer = crime_data[crime_data["date"] \
-        .map(lambda date: date.month) == 7]
-    describe_change_overall(for_ringer, year_min, year_max)
-    print("\n")
-    describe_change_in_variable(for_ringer, year_min, year_max, "primary_type")
-    print("\n")
+    with trace.stage("report: refuting Jacob Ringer"):
+        crime_report.add_section("Refuting Jacob Ringer")
+        if analysis.crime_data is not None:
+            for_ringer = build_crime_cubes(analysis.crime_data, \
+                analysis.time_index, TimeWindow(months=[7]), \
+                max_workers)["months"]
+        else:
+            for_ringer = crime_cubes["months"] \
+                .query("month == 7")
+        describe_change_overall(for_ringer, year_min, year_max, crime_report)
+        crime_report.add("\n")
+        describe_change_in_variable(for_ringer, year_min, year_max, \
+            "primary_type", crime_report)
+        crime_report.add("\n")
     
     # Probability of a crime type at 2111 S. Michigan Avenue
-    print("#### Probability of criminal incident at 2111 S. Michigan Avenue \n")
-    S_MICHIGAN_BLOCK = Point(-87.623565, 41.854015)
-    prob_block = gpd \
-        .GeoDataFrame([S_MICHIGAN_BLOCK], columns=["the_geom"]) \
-        .set_geometry("the_geom")
-    prob_block = gpd \
-        .sjoin(prob_block, blocks) \
-        .drop(columns="index_right")
-    prob_block = prob_block["block_group"].iloc[0]
-    calculate_probability_by_variable_value(crime_data, "block_group", \
-        prob_block, "primary_type")
-    print("\n")
+    with trace.stage("report: probability of crime"):
+        crime_report.add_section(
+            "Probability of criminal incident at 2111 S. Michigan Avenue")
+        S_MICHIGAN_BLOCK = np.array([-87.623565]), np.array([41.854015])
+        prob_block = assign_block_groups(*S_MICHIGAN_BLOCK, block_index)[0]
+        if prob_block < 0:
+            crime_report.add(
+                "2111 S. Michigan Avenue falls outside of every block group.")
+        else:
+            calculate_probability_by_variable_value(crime_cubes["blocks"], \
+                "block_group", block_index.block_groups[prob_block], \
+                "primary_type", crime_report)
+        crime_report.add("\n")
+
+        # Probability for theft in a community.
+        crime_report.add_section("Probability of theft in a community")
+        calculate_probability_by_variable_value(crime_cubes["blocks"], \
+            "primary_type", "THEFT", "community", crime_report)
+        crime_report.add("\n")
+
+    print(crime_report.to_markdown(), end="")
+    return crime_report
+
+
+def update_crime_caches(year_min, year_max, rebuild_geometry=False):
+
+    '''
+    Bring every cache up to date with its source: geometries, the crime
+    store, and ACS themes for the vintages of the years. Incidents are
+    located among block groups as they enter the store.
+
+    year_min (int): lower-bound inclusive year.
+    year_max (int): upper-bound inclusive year.
+    rebuild_geometry (bool): whether to rerequest geometries even if the
+    bundle is current.
+
+    Return number of records upserted (int).
+
+    '''
+
+    trace = PIPELINE_TRACE
+    with trace.stage("compile_community_areas"):
+        compile_community_areas(rebuild_geometry)
+    with trace.stage("compile_block_groups"):
+        blocks = compile_block_groups(rebuild_geometry)
+    block_index = build_block_group_index(blocks)
+    geocode_cache = GeocodeCache(GEOCODE_CACHE, block_index.version)
+    with trace.stage("update_crime_store") as stage:
+        num_records = update_crime_store(year_min, year_max, block_index, \
+            geocode_cache)
+        geocode_cache.save()
+        stage["rows_out"] = num_records
+    with trace.stage("compile_census_data"):
+        compile_census_data(ACS_VARIABLES, vintages=np.unique(
+            match_census_vintages(np.arange(year_min, year_max + 1), \
+                ACS_VINTAGES)))
+    return num_records
+
+
+def join_crime_caches(year_min, year_max):
+
+    '''
+    Join the crime store with the current geometries: locate its records
+    among block groups again if those changed, then count the incidents of
+    each year located in a block group and in a community area.
+
+    year_min (int): lower-bound inclusive year.
+    year_max (int): upper-bound inclusive year.
 
-    # Probability for theft in a community.
-    print("#### Probability of theft in a community \n")
-    calculate_probability_by_variable_value(crime_data, "primary_type", \
-        "THEFT", "community")
-    print("\n")
+    Return incidents located by year (DataFrame).
 
+    '''
+
+    trace = PIPELINE_TRACE
+    communities = compile_community_areas()
+    blocks = compile_block_groups()
+    block_index = build_block_group_index(blocks)
+    geocode_cache = GeocodeCache(GEOCODE_CACHE, block_index.version)
+    with trace.stage("relocate_crime_store"):
+        relocate_crime_store(block_index, geocode_cache)
+        geocode_cache.save()
+    with trace.stage("read_crime_store") as stage:
+        crime_data = read_crime_store(year_min, year_max, \
+            columns=["year", "community_area", "block_group"])
+        stage["rows_out"] = len(crime_data)
+    with trace.stage("join_crime_with_community_areas", \
+        rows_in=len(crime_data)):
+        crime_data = join_crime_with_community_areas(crime_data, communities, \
+            block_index)
+    located = crime_data \
+        .assign(
+            block_group=crime_data["block_group"].notna(),
+            community=crime_data["community"].notna()) \
+        .groupby("year") \
+        .agg(
+            incidents=("block_group", "size"),
+            in_block_group=("block_group", "sum"),
+            in_community=("community", "sum")) \
+        .reset_index()
+    return located
+
+
+def compile_crime_analysis(year_min, year_max, demo_from_csv=False, \
+    max_workers=1, out_of_core=False):
+
+    '''
+    Compile everything the diagnostic reads: geometries and their indexes,
+    crime data located among them, census data for the vintages of the
+    years, and the count cubes that the report sections read. Out of core,
+    only the count cubes are kept, without crime data or its time index.
+
+    year_min (int): lower-bound inclusive year.
+    year_max (int): upper-bound inclusive year.
+    demo_from_csv (bool): whether to compile from existing caches or update.
+    max_workers (int): number of processes counting the cubes, or all cores.
+    out_of_core (bool): whether to count the crime store partition by
+    partition rather than load it whole.
+
+    Return data of the diagnostic (CrimeAnalysis).
+
+    '''
 
-def compile_community_areas():
+    trace = PIPELINE_TRACE
+    with trace.stage("compile_community_areas") as stage:
+        communities = compile_community_areas()
+        stage["rows_out"] = len(communities)
+    with trace.stage("compile_block_groups") as stage:
+        blocks = compile_block_groups()
+        stage["rows_out"] = len(blocks)
+    with trace.stage("build_block_group_index", rows_in=len(blocks)):
+        block_index = build_block_group_index(blocks)
+    geocode_cache = GeocodeCache(GEOCODE_CACHE, block_index.version)
+    crime_data, time_index = None, None
+    if out_of_core:
+        with trace.stage("compile_crime_cubes") as stage:
+            crime_cubes = compile_crime_cubes(year_min, year_max, \
+                communities, blocks, demo_from_csv, block_index=block_index, \
+                geocode_cache=geocode_cache)
+            geocode_cache.save()
+            stage["rows_out"] = sum(len(cube) for cube in crime_cubes.values())
+    else:
+        with trace.stage("compile_crime_data") as stage:
+            crime_data = compile_crime_data(year_min, year_max, communities, \
+                blocks, demo_from_csv, columns=CRIME_REPORT_COLUMNS, \
+                block_index=block_index, geocode_cache=geocode_cache)
+            geocode_cache.save()
+            stage["rows_out"] = len(crime_data)
+    if geocode_cache.hits + geocode_cache.misses:
+        print(
+            "Geocode cache hit rate: " +
+            str(np.round(geocode_cache.hit_rate * 100, 2)) + "%", file=sys.stderr)
+    with trace.stage("compile_census_data") as stage:
+        census_data = compile_census_data(ACS_VARIABLES, vintages=np.unique(
+            match_census_vintages(np.arange(year_min, year_max + 1), \
+                ACS_VINTAGES)))
+        stage["rows_out"] = len(census_data)
+    if crime_data is not None:
+        with trace.stage("build_crime_cubes", rows_in=len(crime_data)) \
+            as stage:
+            crime_cubes = build_crime_cubes(crime_data, \
+                max_workers=max_workers)
+            stage["rows_out"] = sum(len(cube) for cube in crime_cubes.values())
+        time_index = build_crime_time_index(crime_data)
+
+    analysis = CrimeAnalysis(
+        year_min=year_min,
+        year_max=year_max,
+        crime_data=crime_data,
+        time_index=time_index,
+        crime_cubes=crime_cubes,
+        census_data=census_data,
+        block_index=block_index)
+    return analysis
+
+
+def compile_community_areas(rebuild=False):
 
     '''
-    Compile Chicago community areas from the city's data portal.
+    Compile Chicago community areas from the geometry bundle, or from the
+    city's data portal into the bundle if it is missing or stale.
+
+    rebuild (bool): whether to rerequest even if the bundle is current.
 
     Return community areas data (GeoDataFrame).
 
     '''
 
-    communities = pd.DataFrame(requests.get(COMMUNITY_AREAS_API).json())
-    communities["the_geom"] = communities["the_geom"] \
-        .apply(shape)
+    if not rebuild:
+        communities = read_parquet_cache(COMMUNITY_AREAS_PARQUET, \
+            geometry="the_geom")
+        if communities is not None:
+            return communities
+    communities = pd.DataFrame(request_with_retry(
+        requests.Session(), COMMUNITY_AREAS_API, None))
+    communities["the_geom"] = parse_geojson(communities["the_geom"])
     communities = gpd.GeoDataFrame(communities) \
         .set_geometry("the_geom") \
         .drop(columns=["area_numbe", "comarea", "comarea_id"])
+    os.makedirs(GEOMETRY_BUNDLE, exist_ok=True)
+    write_parquet_cache(communities, COMMUNITY_AREAS_PARQUET, \
+        geometry="the_geom")
     return communities
 
 
-def compile_block_groups(demo_from_csv=False):
+def compile_block_groups(rebuild=False, simplify=GEOMETRY_SIMPLIFY_TOLERANCE):
 
     '''
-    Compile Chicago block groups from the city's data portal.
+    Compile Chicago block groups from the census blocks of the city's data
+    portal into the geometry bundle. Blocks are dissolved into block groups
+    once, and each block group keeps its bounding box beside its WKB, so
+    later runs load the bundle instead of requesting, parsing, and
+    dissolving again, until it is missing or stale.
 
-    demo_from_csv (bool): whether to compile from existing CSV or rerequest.
+    rebuild (bool): whether to rerequest even if the bundle is current.
+    simplify (float): tolerance to simplify geometries to, or None to keep
+    every vertex.
 
     Return block groups data (GeoDataFrame).
 
     '''
 
-    if demo_from_csv:
-        blocks = pd.read_csv(CENSUS_BLOCK_GROUPS_CSV, dtype=str)
-        blocks["the_geom"] = blocks["the_geom"] \
-            .apply(shapely.wkt.loads)
-    else:
-        blocks = request_census_blocks()
-        blocks["block_group"] = blocks["geoid10"] \
-            .apply(lambda block: block[:12])
-        blocks["the_geom"] = blocks["the_geom"] \
-            .apply(shape) \
-            .apply(unary_union)
-    blocks = gpd.GeoDataFrame(blocks) \
-        .set_geometry("the_geom") \
-        .drop(columns=blocks.columns.difference(["block_group", "the_geom"]))
-    if not demo_from_csv:
-        blocks.to_csv(CENSUS_BLOCK_GROUPS_CSV, index=False)
+    stamps = {"simplify": str(simplify)}
+    if not rebuild:
+        blocks = read_parquet_cache(BLOCK_GROUPS_PARQUET, geometry="the_geom", \
+            metadata=stamps)
+        if blocks is not None:
+            return blocks
+    with PIPELINE_TRACE.stage("request_soap_data") as stage:
+        blocks = request_soap_data(CENSUS_BLOCKS_API)
+        stage["rows_out"] = len(blocks)
+    with PIPELINE_TRACE.stage("dissolve_block_groups", \
+        rows_in=len(blocks)) as stage:
+        blocks = dissolve_block_groups(blocks, simplify)
+        stage["rows_out"] = len(blocks)
+    os.makedirs(GEOMETRY_BUNDLE, exist_ok=True)
+    write_parquet_cache(blocks, BLOCK_GROUPS_PARQUET, geometry="the_geom", \
+        metadata=stamps)
     return blocks
 
 
-def request_census_blocks(max_records=1000):
+def dissolve_block_groups(blocks, simplify=GEOMETRY_SIMPLIFY_TOLERANCE):
 
     '''
-    Request Chicago block groups data from city's SOAP API.
+    Dissolve census blocks into the block groups that prefix their GEOIDs,
+    simplify them if desired, and note the bounding box of each. Simplifying
+    preserves the topology of each block group, but may open slivers between
+    neighbors that incidents on the boundary fall into.
 
-    max_records (int): number of records desired with each request.
+    blocks (DataFrame): census blocks from Chicago's data portal.
+    simplify (float): tolerance to simplify geometries to, or None to keep
+    every vertex.
 
-    Return block groups data (DataFrame).
+    Return block groups data (GeoDataFrame).
 
     '''
 
-    census_blocks = []
-    keep_requesting = True
-    while keep_requesting:
-        request = requests.get(
-            CENSUS_BLOCKS_API,
-            params=set_census_blocks_params(max_records, len(census_blocks)))
-        new_census_blocks = request.json()
-        if len(new_census_blocks) < max_records:
-            keep_requesting = False
-        census_blocks.extend(new_census_blocks)
-    return pd.DataFrame(census_blocks)
+    blocks = gpd.GeoDataFrame({
+        "block_group": blocks["geoid10"].str[:12],
+        "the_geom": parse_geojson(blocks["the_geom"])}) \
+        .set_geometry("the_geom") \
+        .dissolve(by="block_group") \
+        .reset_index()
+    if simplify:
+        blocks["the_geom"] = shapely.simplify(
+            np.asarray(blocks.geometry.values), simplify, preserve_topology=True)
+    blocks[BOUNDS_COLUMNS] = shapely.bounds(np.asarray(blocks.geometry.values))
+    return blocks
 
 
-def set_census_blocks_params(max_records, num_records):
+def parse_geojson(geometries):
 
     '''
-    Set parameters for next SOAP API request of block groups data.
+    Parse GeoJSON geometries from the city's data portal in one pass.
 
-    max_records (int): number of records desired with next request.
-    num_records (int): number of records obtained so far for offset.
+    geometries (Series): GeoJSON geometries (dict).
 
-    Return parameters (dict).
+    Return geometries (array).
 
     '''
 
-    parameters = {
-        "$limit": max_records,
-        "$offset": num_records}
-    return parameters
+    return shapely.from_geojson(geometries.map(json.dumps).to_numpy())
 
 
-def compile_crime_data(year_min, year_max, communities, blocks, \
-    demo_from_csv=False):
+def request_soap_data(api, params=None, page_size=SOAP_PAGE_SIZE, \
+    max_workers=SOAP_MAX_WORKERS):
 
     '''
-    Compile Chicago crime data from the city's data portal.
+    Request all records that match some parameters from a SOAP API of the
+    city's data portal and stitch the pages together in order.
 
-    year_min (int): lower-bound inclusive year for request.
-    year_max (int): upper-bound inclusive year for request.
-    communities (GeoDataFrame): to assign community areas to incidents.
-    blocks (GeoDataFrame): to assign block groups to incidents.
-    demo_from_csv (bool): whether to compile from existing CSV or rerequest.
+    api (str): endpoint of the dataset.
+    params (dict): filters on the dataset, i.e. $where, in addition to paging.
+    page_size (int): number of records desired with each request.
+    max_workers (int): number of requests allowed in flight at once.
 
-    Return crime data (GeoDataFrame).
+    Return data (DataFrame).
 
     '''
 
-    if demo_from_csv:
-        crime_data = pd.read_csv(CHICAGO_CRIME_CSV, dtype=str)
-    else:
-        crime_data = request_crime_data(year_min)
-        for y in range(1, year_max - year_min + 1):
-            crime_data = crime_data.append(request_crime_data(year_min + y))
-        crime_data.to_csv(CHICAGO_CRIME_CSV, index=False)
-    crime_data["date"] = pd.DatetimeIndex(crime_data["date"]) \
-        .normalize()
-    crime_data = join_crime_with_community_areas(crime_data, communities)
-    crime_data = join_crime_with_block_groups(crime_data, blocks)
-    return crime_data
+    pages = iterate_soap_pages(api, params, page_size, max_workers)
+    return pd.DataFrame([record for page in pages for record in page])
 
 
-def request_crime_data(year, max_records=1000):
+def iterate_soap_pages(api, params=None, page_size=SOAP_PAGE_SIZE, \
+    max_workers=SOAP_MAX_WORKERS, order=":id"):
 
     '''
-    Request Chicago crime data from city's SOAP API.
+    Request the pages of records that match some parameters from a SOAP API
+    of the city's data portal. Count the records first, then request the
+    pages concurrently over one pooled session, yielding them in order. No
+    more than max_workers pages are in flight or waiting at once, so memory
+    stays bounded however many records match.
 
-    year_min (int): lower-bound inclusive year for request.
-    max_records (int): number of records desired with each request.
+    api (str): endpoint of the dataset.
+    params (dict): filters on the dataset, i.e. $where, in addition to paging.
+    page_size (int): number of records desired with each request.
+    max_workers (int): number of requests allowed in flight at once.
+    order (str): $order of the records, ending on the row identifier.
 
-    Return crime data (DataFrame).
+    Yield page of records (lst).
 
     '''
 
-    crime_data = []
-    keep_requesting = True
-    while keep_requesting:
-        request = requests.get(
-            CRIME_DATA_API,
-            params=set_crime_data_params(year, max_records, len(crime_data)))
-        new_crime_data = request.json()
-        if len(new_crime_data) < max_records:
-            keep_requesting = False
-        crime_data.extend(new_crime_data)
-    return pd.DataFrame(crime_data)
+    params = dict(params or {})
+    session = create_http_session(max_workers)
+    try:
+        num_records = request_soap_count(session, api, params)
+        offsets = iter(range(0, num_records, page_size))
+        last_size = page_size
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for offset in islice(offsets, max_workers):
+                pending.append(executor.submit(request_with_retry, session, \
+                    api, set_soap_params(params, page_size, offset, order)))
+            while pending:
+                page = pending.popleft().result()
+                for offset in islice(offsets, 1):
+                    pending.append(executor.submit(request_with_retry, session, \
+                        api, set_soap_params(params, page_size, offset, order)))
+                last_size = len(page)
+                yield page
+        # Records added since the count land beyond the last page we expected.
+        offset = -(-num_records // page_size) * page_size
+        while last_size == page_size:
+            page = request_with_retry(session, api, \
+                set_soap_params(params, page_size, offset, order))
+            offset += page_size
+            last_size = len(page)
+            if page:
+                yield page
+    finally:
+        session.close()
+
+
+def request_soap_count(session, api, params):
 
+    '''
+    Request the number of records that match some parameters from a SOAP API
+    of the city's data portal.
+
+    session (Session): pooled HTTP session.
+    api (str): endpoint of the dataset.
+    params (dict): filters on the dataset, i.e. $where.
 
-def set_crime_data_params(year, max_records, num_records):
+    Return number of records (int).
 
     '''
-    Set parameters for next SOAP API request of crime data.
 
-    year_min (int): lower-bound inclusive year for request.
-    max_records (int): number of records desired with next request.
-    num_records (int): number of records obtained so far for offset.
+    count = request_with_retry(session, api, dict(params, **{
+        "$select": "count(*)"}))
+    return int(next(iter(count[0].values())))
+
+
+def set_soap_params(params, page_size, offset, order=":id"):
+
+    '''
+    Set parameters for one page of a SOAP API request. The order should end
+    on the row identifier so that pages do not overlap.
+
+    params (dict): filters on the dataset, i.e. $where.
+    page_size (int): number of records desired with the request.
+    offset (int): number of records that precede this page.
+    order (str): $order of the records.
 
     Return parameters (dict).
 
     '''
 
-    parameters = {
-        "year": year,
-        "$limit": max_records,
-        "$offset": num_records}
+    parameters = dict(params, **{
+        "$order": order,
+        "$limit": page_size,
+        "$offset": offset})
     return parameters
 
 
-def compile_census_data(variable_dicts, demo_from_csv=False):
+def create_http_session(max_workers=SOAP_MAX_WORKERS):
 
     '''
-    Compile Cook County data from US Census Bureau's American Community Survey,
-    five-year 2017.
+    Create an HTTP session whose connection pool can serve every worker.
 
-    variable_dicts (lst): collection of dictionaries of variables desired.
-    demo_from_csv (bool): whether to compile from existing CSV or rerequest.
+    max_workers (int): number of requests allowed in flight at once.
+
+    Return session (Session).
 
-    Return census data (DataFrame).
-    
     '''
 
-    if demo_from_csv:
-        crime_data = pd.read_csv(CENSUS_DATA_CSV, dtype=str)
-        return crime_data
-    LOCATION_VARIABLES = ["state", "county", "tract", "block group"]
-    census_data = request_census_data(variable_dicts.pop())
-    for variable_dict in variable_dicts:
-        census_data = census_data \
-            .merge(
-                request_census_data(variable_dict),
-                how="outer",
-                on=LOCATION_VARIABLES)
-    census_data["block_group"] = census_data \
-        .apply(
-            lambda row: "".join(str(row[var]) for var in LOCATION_VARIABLES),
-            axis=1)
-    census_data = census_data \
-        .drop(columns=LOCATION_VARIABLES)
-    if not demo_from_csv:
-        census_data.to_csv(CENSUS_DATA_CSV, index=False)
-    return census_data
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
-def request_census_data(variable_dict):
+class DataSourceError(LookupError):
 
     '''
-    Request Cook County ACS data from Census Bureau's API.
+    A request that the data source cannot answer without the network.
 
-    variable_dict (dict): collection of variables for one demographic theme.
+    '''
 
-    Return crime data (DataFrame).
+
+class LiveSource:
 
     '''
+    Source of data from the live APIs of the city's data portal and the
+    Census Bureau.
 
-    request = requests.get(
-        ACS_API,
-        params=set_census_data_params(variable_dict))
-    census_data = request.json()
-    labels = [variable_dict.get(var, var) for var in census_data.pop(0)]
-    census_data = pd.DataFrame(census_data, columns=labels)
-    census_data = normalize_census_data_variables(census_data, variable_dict)
-    return census_data
+    '''
 
+    def request(self, session, api, params):
 
-def set_census_data_params(variable_dict):
+        '''
+        Request an API over HTTP.
 
-    '''
-    Set parameters for next Census Bureau API request of ACS data.
+        session (Session): pooled HTTP session.
+        api (str): endpoint of the dataset.
+        params (dict): parameters of the request.
 
-    variable_dict (dict): collection of demographic variables for one theme, 
-    i.e. education, income, race.
+        Return response (Response).
 
-    Return parameters (dict).
+        '''
+
+        return session.get(api, params=params, timeout=SOAP_TIMEOUT_SECONDS)
+
+
+class RecordedSource:
 
     '''
+    Stand-in for the live APIs that records their responses on disk and
+    replays them, so that stages can be rerun on the same inputs without
+    the network. Each request is recorded under a digest of its endpoint
+    and parameters, and its body under a digest of its content, which is
+    checked again on replay.
 
-    parameters = {
-        "get": ",".join(var for var in variable_dict.keys()),
-        "for": "block group:*",
-        "in": "state:17 county:031"} # Cook County, Illinois
-    return parameters
+    '''
 
+    def __init__(self, directory, record=True):
+
+        '''
+        directory (str): location of the recordings.
+        record (bool): whether to request and record what was not recorded,
+        or fail instead.
+
+        '''
+
+        self.directory = directory
+        self.record = record
+
+
+    def request(self, session, api, params):
+
+        '''
+        Replay the response to a request, or request and record it.
+
+        session (Session): pooled HTTP session.
+        api (str): endpoint of the dataset.
+        params (dict): parameters of the request.
+
+        Return response (Response).
+
+        '''
+
+        key = hashlib.sha256(json.dumps([api, params], sort_keys=True, \
+            default=str).encode()).hexdigest()
+        path = os.path.join(self.directory, "requests", key + ".json")
+        if os.path.exists(path):
+            return self.replay(path)
+        if not self.record:
+            raise DataSourceError("no recording of " + api + " with " + \
+                json.dumps(params, sort_keys=True, default=str))
+        response = session.get(api, params=params, timeout=SOAP_TIMEOUT_SECONDS)
+        if response.status_code == 200:
+            self.save(path, api, params, response)
+        return response
+
+
+    def save(self, path, api, params, response):
+
+        '''
+        Save a response, its body first, so that a request is never recorded
+        without its body.
+
+        path (str): location of the recording of the request.
+        api (str): endpoint of the dataset.
+        params (dict): parameters of the request.
+        response (Response): response to the request.
+
+        Return None.
+
+        '''
+
+        digest = hashlib.sha256(response.content).hexdigest()
+        body = os.path.join(self.directory, "bodies", digest)
+        os.makedirs(os.path.dirname(body), exist_ok=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not os.path.exists(body):
+            with open(body + ".tmp-" + str(threading.get_ident()), "wb") as f:
+                f.write(response.content)
+            os.replace(f.name, body)
+        with open(path + ".tmp-" + str(threading.get_ident()), "w") as f:
+            json.dump({
+                "api": api,
+                "params": params,
+                "status": response.status_code,
+                "content_type": response.headers.get("Content-Type"),
+                "sha256": digest}, f, indent=2, sort_keys=True, default=str)
+        os.replace(f.name, path)
 
-def normalize_census_data_variables(census_data, variable_dict):
+
+    def replay(self, path):
+
+        '''
+        Replay a recorded response, checking its body against its digest.
+
+        path (str): location of the recording of the request.
+
+        Return response (Response).
+
+        '''
+
+        with open(path) as f:
+            recording = json.load(f)
+        with open(os.path.join(self.directory, "bodies", \
+            recording["sha256"]), "rb") as f:
+            content = f.read()
+        if hashlib.sha256(content).hexdigest() != recording["sha256"]:
+            raise DataSourceError("recorded body does not match its digest: " + \
+                recording["sha256"])
+        response = requests.Response()
+        response.status_code = recording["status"]
+        response.url = recording["api"]
+        response.headers["Content-Type"] = recording["content_type"]
+        response._content = content
+        response.from_recording = True
+        return response
+
+
+class SnapshotSource:
 
     '''
-    Convert demographic variables into proportion of their themes, i.e.
-    education, income, race.
+    Source of data from a snapshot of the local caches: the geometry bundle,
+    the crime store, ACS themes, and geocodes, restored over those of the
+    working directory before a run. It answers no requests, so a stage that
+    finds its caches out of date fails rather than reaching the network.
 
-    census_data (DataFrame): data from Census Bureau API request.
-    variable_dict (dict): collection of demographic variables for one theme.
+    '''
 
-    Return updated census data (DataFrame).
+    def __init__(self, directory):
+
+        '''
+        directory (str): location of the snapshot.
+
+        '''
+
+        self.directory = directory
+
+
+    def request(self, session, api, params):
+
+        raise DataSourceError("snapshot " + self.directory + \
+            " answers no requests, such as to " + api)
+
+
+    def save(self, caches=DATA_SNAPSHOT_CACHES):
+
+        '''
+        Save the caches of the working directory as the snapshot, with a
+        digest of each file.
+
+        caches (lst): directories of the caches.
+
+        Return None.
+
+        '''
+
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory)
+        for cache in caches:
+            if os.path.isdir(cache):
+                shutil.copytree(cache, os.path.join(self.directory, cache))
+        with open(os.path.join(self.directory, DATA_SNAPSHOT_MANIFEST), "w") as f:
+            json.dump(hash_snapshot_files(self.directory), f, indent=2, \
+                sort_keys=True)
+
+
+    def restore(self, replace=False, caches=DATA_SNAPSHOT_CACHES):
+
+        '''
+        Restore the caches of the snapshot into the working directory, after
+        checking every file against its digest. Caches of the working
+        directory that differ from the snapshot are replaced only if asked,
+        so that a run from a snapshot never discards them unawares.
+
+        replace (bool): whether to replace caches that differ.
+        caches (lst): directories of the caches.
+
+        Return None.
+
+        '''
+
+        try:
+            with open(os.path.join(self.directory, DATA_SNAPSHOT_MANIFEST)) as f:
+                digests = json.load(f)
+        except FileNotFoundError:
+            raise DataSourceError("no snapshot in " + self.directory)
+        if hash_snapshot_files(self.directory) != digests:
+            raise DataSourceError("snapshot " + self.directory + \
+                " does not match its digests")
+        existing = [cache for cache in caches if os.path.isdir(cache)]
+        if existing:
+            if hash_snapshot_files(".", caches) == digests:
+                return
+            if not replace:
+                raise DataSourceError("restoring snapshot " + self.directory + \
+                    " would replace " + ", ".join(existing) + " in the working "
+                    "directory; run from an empty directory or replace them "
+                    "explicitly with --replace-caches")
+        for cache in caches:
+            if os.path.isdir(cache):
+                shutil.rmtree(cache)
+            if os.path.isdir(os.path.join(self.directory, cache)):
+                shutil.copytree(os.path.join(self.directory, cache), cache)
+
+
+def hash_snapshot_files(directory, caches=None):
 
     '''
+    Digest every file of a snapshot but its manifest, or of some caches.
 
-    columns, exclude = isolate_respondents_label(variable_dict.values())
-    normalized = census_data[columns] \
-        .astype(float) \
-        .div(census_data[exclude].astype(float), axis=0)
-    census_data = census_data.drop(columns=columns)
-    census_data = pd.concat([census_data, normalized], axis=1)
-    return census_data
+    directory (str): location of the snapshot.
+    caches (lst): directories of the caches to digest, or all if None.
 
+    Return digests by relative path (dict).
 
-def isolate_respondents_label(labels):
+    '''
+
+    digests = {}
+    roots = [directory] if caches is None \
+        else [os.path.join(directory, cache) for cache in caches]
+    paths = [
+        os.path.join(walked, name)
+        for root in roots
+        for walked, _, files in os.walk(root)
+        for name in files]
+    for path in paths:
+        relative = os.path.relpath(path, directory)
+        if relative == DATA_SNAPSHOT_MANIFEST:
+            continue
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(2 ** 20), b""):
+                digest.update(block)
+        digests[relative] = digest.hexdigest()
+    return digests
+
+
+def open_data_source(spec):
 
     '''
-    Identify the column that has the sum of respondents for a theme, i.e.
-    education, income, race.
+    Open a data source from its description: live, record:<directory>,
+    replay:<directory>, or snapshot:<directory>.
 
-    labels (lst): column names for one theme.
+    spec (str): description of the data source.
 
-    Return demographic columns, sum column (tuple).
+    Return data source (LiveSource, RecordedSource, or SnapshotSource).
 
     '''
 
-    regex = re.compile(r".*_respondents")
-    respondents = list(filter(regex.match, labels))[0]
-    columns = [col for col in labels if col != respondents]
-    return columns, respondents
+    kind, _, directory = spec.partition(":")
+    if kind == "live" and not directory:
+        return LiveSource()
+    if kind in ["record", "replay"] and directory:
+        return RecordedSource(directory, record=kind == "record")
+    if kind == "snapshot" and directory:
+        return SnapshotSource(directory)
+    raise ValueError("expected live, record:<directory>, replay:<directory>, "
+        "or snapshot:<directory>, not " + spec)
 
 
-def join_crime_with_community_areas(crime_data, communities):
+def set_data_source(source):
 
     '''
-    Join crime data and community areas data on community area number.
+    Set the source that every request of the diagnostic goes through.
 
-    crime_data (DataFrame): crime data from Chiago's data portal.
-    communities (DataFrame): community areas.
+    source (LiveSource, RecordedSource, or SnapshotSource): data source.
 
-    Return join (DataFrame).
+    Return previous data source (LiveSource, RecordedSource, or SnapshotSource).
 
     '''
 
-    joined_data = crime_data.merge(
-        communities[["area_num_1", "community"]],
-        left_on="community_area",
-        right_on="area_num_1")
-    return joined_data
+    global DATA_SOURCE
+    previous, DATA_SOURCE = DATA_SOURCE, source
+    return previous
+
+
+DATA_SOURCE = LiveSource()
 
 
-def join_crime_with_block_groups(crime_data, blocks):
+def request_with_retry(session, api, params, max_retries=SOAP_MAX_RETRIES, \
+    backoff=SOAP_BACKOFF_SECONDS):
 
     '''
-    Join crime data and block groups data on longitude, latitude.
+    Request JSON from an API through the data source, retrying with
+    exponential backoff on connection errors, timeouts, throttling, and
+    server errors.
 
-    crime_data (DataFrame): crime data from Chiago's data portal.
-    blocks (GeoDataFrame): block group data from Chicago's data portal.
+    session (Session): pooled HTTP session.
+    api (str): endpoint of the dataset.
+    params (dict): parameters of the request.
+    max_retries (int): number of attempts allowed after the first.
+    backoff (float): seconds to wait before the first retry, doubled after.
 
-    Return spatial join (GeoDataFrame).
+    Return response (list or dict).
 
     '''
 
-    crime_data = crime_data \
-        .dropna(subset=["longitude", "latitude"])
-    crime_data["the_geom"] = crime_data \
-        .apply(
-            lambda row: Point(float(row["longitude"]), float(row["latitude"])),
-            axis=1)
-    crime_data = gpd.GeoDataFrame(crime_data) \
-        .set_geometry("the_geom")
-    joined_data = gpd \
-        .sjoin(crime_data, blocks[["block_group", "the_geom"]]) \
-        .drop(columns="index_right")
-    return joined_data
+    for attempt in range(max_retries + 1):
+        try:
+            request = DATA_SOURCE.request(session, api, params)
+            PIPELINE_TRACE.count_request(request)
+            if request.status_code not in SOAP_RETRY_STATUS:
+                request.raise_for_status()
+                return request.json()
+            error = requests.HTTPError(
+                str(request.status_code) + " from " + api, response=request)
+        except (requests.ConnectionError, requests.Timeout) as exception:
+            error = exception
+        if attempt < max_retries:
+            time.sleep(backoff * 2 ** attempt)
+    raise error
 
 
-def describe_change_overall(crime_data, year_min, year_max):
+def compile_crime_data(year_min, year_max, communities, blocks, \
+    demo_from_csv=False, columns=None, crimes=None, block_index=None, \
+    geocode_cache=None):
 
-    crime_data = crime_data \
-        .groupby("year") \
-        .size()
-    crime_data = crime_data.append(
-        pd.Series(
-            [(crime_data[str(year_max)] - crime_data[str(year_min)]) \
-                / crime_data[str(year_min)]], index=["change"]))
-    crime_data = crime_data \
-        .reset_index()
-    crime_data.columns = ["year", "incidents"]
-    print(
-        tabulate(crime_data, headers="keys", tablefmt="simple", showindex="never"))
+    '''
+    Compile Chicago crime data from the city's data portal. Incidents are
+    located among block groups as they enter the store, so only the join
+    with community areas remains. Incidents are sorted on date and time, so
+    time windows can be selected by binary search.
 
+    year_min (int): lower-bound inclusive year for request.
+    year_max (int): upper-bound inclusive year for request.
+    communities (GeoDataFrame): to assign community areas to incidents.
+    blocks (GeoDataFrame): to assign block groups to incidents.
+    demo_from_csv (bool): whether to compile from existing store or update it.
+    columns (lst): columns to load from the store, or all if None.
+    crimes (lst): primary types to load from the store, or all if None.
+    block_index (BlockGroupIndex): prebuilt spatial index over blocks, if any.
+    geocode_cache (GeocodeCache): locations already known, if any.
 
-def describe_change_in_variable(crime_data, year_min, year_max, variable):
+    Return crime data (DataFrame).
 
-    crime_data = crime_data \
-        .groupby(["year", variable]) \
-        .size() \
-        .unstack(0) \
-        .reset_index()
-    crime_data["change"] = crime_data \
-        .apply(
-            lambda row: (row[str(year_max)] - row[str(year_min)]) / row[str(year_min)],
-            axis=1)
-    crime_data = crime_data \
-        .fillna(0) \
-        .sort_values(by="change", ascending=False)
-    print(
-        tabulate(crime_data, headers="keys", tablefmt="simple", showindex="never"))
+    '''
 
+    trace = PIPELINE_TRACE
+    if block_index is None:
+        block_index = build_block_group_index(blocks)
+    refresh_crime_store(year_min, year_max, block_index, demo_from_csv, \
+        geocode_cache)
+    with trace.stage("read_crime_store") as stage:
+        crime_data = read_crime_store(year_min, year_max, columns=columns, \
+            crimes=crimes)
+        stage["rows_out"] = len(crime_data)
+    crime_data = crime_data[crime_data["block_group"].notna()] \
+        .sort_values(by="date", kind="mergesort", ignore_index=True)
+    with trace.stage("join_crime_with_community_areas", \
+        rows_in=len(crime_data)) as stage:
+        crime_data = join_crime_with_community_areas(crime_data, communities, \
+            block_index)
+        stage["rows_out"] = len(crime_data)
+    with trace.stage("compact_crime_data", rows_in=len(crime_data)):
+        crime_data = compact_crime_data(crime_data)
+    return crime_data
 
-def plot_trend_of_crime_incidence(crime_data, year_min, year_max, crime):
 
-    figure, axes = plt.subplots()
-    crime_data = crime_data[crime_data["primary_type"] == crime.upper()] \
-        .groupby(pd.Grouper(key="date", freq="W-MON"))["primary_type"] \
-        .size()
-    crime_data.plot()
-    axes.set(
-        xlabel="Date",
-        ylabel="Incidence",
-        title=crime.title())
-    crime = "-".join(crime.split())
-    plt.savefig("-".join(["chicago", crime, str(year_min), str(year_max)]) + ".png")
+def refresh_crime_store(year_min, year_max, block_index, demo_from_csv=False, \
+    geocode_cache=None):
 
+    '''
+    Update the crime store from the city's data portal, or, in demo mode
+    with a current store, only locate it again among block groups if those
+    changed.
 
-def describe_block_with_kth_most_crime(crime_data, census_data, year_min, year_max, crime, k):
-    
-    kth_block = crime_data[crime_data["primary_type"] == crime.upper()] \
-        .groupby(["year", "block_group"])["primary_type"] \
-        .agg(np.size) \
-        .fillna(0) \
-        .unstack(0) \
-        .reset_index() \
-        .merge(
-            crime_data[["block_group", "community"]].drop_duplicates(),
-            on="block_group", how="inner") \
-        .merge(census_data, on="block_group", how="left") \
-        .sort_values(by=str(year_max), ascending=False) \
-        .iloc[k]
-    print(
-        "\n" + kth_block["community"].title() + ", block no. " + 
-        str(kth_block["block_group"]) + ":\n\n"
-        "    Ranked no. " + str(k + 1) + " for most CPD responses to " +
-        "incidents of " + crime.lower() + " in " + str(year_max) + ":\n" + 
-        "    " + str(year_max) + ": " + str(kth_block[str(year_max)]) + "\n" +
-        "    " + str(year_min) + ": " + str(kth_block[str(year_min)]) + "\n\n" +
-        "    Groups most represented in ACS statistics for this block:")
-    kth_block = kth_block \
-        .drop(["block_group", "community"]) \
-        .astype(float) \
-        .sort_values(ascending=False)
-    indicators = get_top_block_census_indicators(kth_block, ACS_VARIABLES)
-    for indicator, percent in indicators:
-        print(
-            "    " + indicator + ": " + str(np.round(percent * 100, 2)) + "%")
+    year_min (int): lower-bound inclusive year for request.
+    year_max (int): upper-bound inclusive year for request.
+    block_index (BlockGroupIndex): spatial index over blocks.
+    demo_from_csv (bool): whether to compile from existing store or update it.
+    geocode_cache (GeocodeCache): locations already known, if any.
 
+    Return None.
 
-def get_top_block_census_indicators(block, variable_dicts):
+    '''
 
-    indicators = []
-    for variable_dict in variable_dicts:
-        best_indicator = (None, None)
-        columns, _ = isolate_respondents_label(variable_dict.values())
-        for variable in columns:
-            loc = block.index.get_loc(variable)
-            if best_indicator[0] is None or loc < best_indicator[0]:
-                best_indicator = loc, variable
-        if best_indicator[0]:
-            indicators.append([
-                best_indicator[1],
-                block.iloc[best_indicator[0]]])
-    return indicators
+    trace = PIPELINE_TRACE
+    if not demo_from_csv or not crime_store_is_current():
+        with trace.stage("update_crime_store") as stage:
+            stage["rows_out"] = update_crime_store(year_min, year_max, \
+                block_index, geocode_cache)
+    else:
+        with trace.stage("relocate_crime_store"):
+            relocate_crime_store(block_index, geocode_cache)
 
 
-def calculate_probability_by_variable_value(crime_data, variable, value, group):
+def compile_crime_cubes(year_min, year_max, communities, blocks, \
+    demo_from_csv=False, crimes=None, block_index=None, geocode_cache=None):
 
-    prob_crime = crime_data[crime_data[variable] == value] \
-        .groupby(group) \
-        .size() \
-        .reset_index()
-    prob_crime.columns = [group, "incidents"]
-    prob_crime["probability"] = prob_crime \
-        .apply(
-            lambda crime: crime["incidents"] / prob_crime["incidents"].sum(),
-            axis=1)
-    prob_crime = prob_crime \
-        .sort_values(by="probability", ascending=False)
-    print(
-        tabulate(prob_crime, headers="keys", tablefmt="simple", showindex="never"))
-    
-    
-def run():
+    '''
+    Compile the count cubes of Chicago crime data out of core: the crime
+    store is scanned one monthly partition at a time, and each partition is
+    joined with community areas, counted into partial cubes, and dropped.
+    Partial cubes are merged as they pile up, so memory holds about one
+    partition and the merged counts however many years are compiled. Block
+    groups are counted by their integer position in the spatial index, and
+    named only once the counts are merged.
 
-    arguments = sys.argv[1:]
-    if len(arguments) < 6:
-        print(
-            "Expected at least five arguments:\n"
-            "  1. inclusive upper bound year,\n"
-            "  2. inclusive lower bound year,\n"
-            "  3. comma delimited crimes,\n"
-            "  4. number of highest-incidence blocks,\n"
-            "  5. whether to run in demo mode from existing CSV files.")
-        sys.exit()
-    try:
-        demo = bool(arguments.pop())
-    except TypeError:
-        print(
-            "Expected a truth value for the fifth argument:\n"
-            "  5. whether to run in demo mode from existing CSV files.")
-    try:
-        k_most = int(arguments.pop())
-    except TypeError:
-        print(
-            "Expected an integer for the fourth argument:\n"
-            "  4. number of highest-incidence blocks.")
-    try:
-        year_min = int(arguments.pop(0))
-        year_max = int(arguments.pop(0))
-    except TypeError:
-        print(
-            "Expected integers for the first two arguments:\n"
-            "  1. inclusive upper bound year,\n"
-            "  2. inclusive lower bound year.\n")
-    crimes = " ".join(arguments)
-    if not crimes:
+    year_min (int): lower-bound inclusive year for request.
+    year_max (int): upper-bound inclusive year for request.
+    communities (GeoDataFrame): to assign community areas to incidents.
+    blocks (GeoDataFrame): to assign block groups to incidents.
+    demo_from_csv (bool): whether to compile from existing store or update it.
+    crimes (lst): primary types to count, or all if None.
+    block_index (BlockGroupIndex): prebuilt spatial index over blocks, if any.
+    geocode_cache (GeocodeCache): locations already known, if any.
+
+    Return incidents by each rollup in CRIME_CUBE_ROLLUPS (dict).
+
+    '''
+
+    trace = PIPELINE_TRACE
+    if block_index is None:
+        block_index = build_block_group_index(blocks)
+    refresh_crime_store(year_min, year_max, block_index, demo_from_csv, \
+        geocode_cache)
+    community_index = build_community_index(communities, block_index)
+    crime_cubes, partial_cubes = None, []
+    partitions = iterate_crime_store(year_min, year_max, \
+        columns=CRIME_REPORT_COLUMNS, crimes=crimes)
+    for crime_data in partitions:
+        with trace.stage("count_crime_partition", rows_in=len(crime_data), \
+            tally=True):
+            crime_data = crime_data.take(
+                np.flatnonzero(crime_data["block_group"].notna()))
+            crime_data = join_crime_with_community_areas(crime_data, \
+                communities, block_index, community_index)
+            crime_data["block_group"] = community_index.block_groups \
+                .get_indexer(crime_data["block_group"]) \
+                .astype(np.int32)
+            partial_cubes.append(build_crime_cubes(crime_data))
+        if sum(len(cube["blocks"]) for cube in partial_cubes) \
+            >= CRIME_CUBE_MERGE_ROWS:
+            crime_cubes = merge_crime_cubes([crime_cubes] + partial_cubes)
+            partial_cubes = []
+    crime_cubes = merge_crime_cubes([crime_cubes] + partial_cubes)
+    for crime_cube in crime_cubes.values():
+        if "block_group" in crime_cube:
+            crime_cube["block_group"] = pd.Categorical.from_codes(
+                crime_cube["block_group"], categories=block_index.block_groups)
+    return {
+        rollup: crime_cube.astype({
+            column: dtype
+            for column, dtype in CRIME_COMPACT_SCHEMA.items()
+            if column in crime_cube and column != "block_group"})
+        for rollup, crime_cube in crime_cubes.items()}
+
+
+def merge_crime_cubes(partial_cubes):
+
+    '''
+    Merge partial count cubes, i.e. of different partitions of the crime
+    store, by summing the incidents of each rollup.
+
+    partial_cubes (lst): incidents by each rollup (dict), or None to skip.
+
+    Return incidents by each rollup in CRIME_CUBE_ROLLUPS, empty if there are
+    no partial cubes (dict).
+
+    '''
+
+    partial_cubes = [cubes for cubes in partial_cubes if cubes is not None]
+    if not partial_cubes:
+        return {
+            rollup: pd.DataFrame(columns=dimensions + ["incidents"]) \
+                .astype({"incidents": np.int64})
+            for rollup, dimensions in CRIME_CUBE_ROLLUPS.items()}
+    crime_cubes = {
+        rollup: pd.concat(
+            [cubes[rollup] for cubes in partial_cubes],
+            ignore_index=True, sort=False) \
+            .groupby(dimensions, observed=True, dropna=False)["incidents"] \
+            .sum() \
+            .reset_index()
+        for rollup, dimensions in CRIME_CUBE_ROLLUPS.items()}
+    return crime_cubes
+
+
+def compact_crime_data(crime_data):
+
+    '''
+    Cast crime data to compact types: categories for fields with few distinct
+    values, small integers for years, and floats only as wide as their
+    precision needs. Report memory before and after.
+
+    crime_data (DataFrame): crime data joined with communities and blocks.
+
+    Return crime data (DataFrame).
+
+    '''
+
+    before = crime_data.memory_usage(deep=True).sum()
+    crime_data = crime_data.astype({
+        column: dtype
+        for column, dtype in CRIME_COMPACT_SCHEMA.items()
+        if column in crime_data})
+    after = crime_data.memory_usage(deep=True).sum()
+    print(
+        "Crime data in memory: " + str(np.round(before / 2 ** 20, 1)) +
+        " MB before compaction, " + str(np.round(after / 2 ** 20, 1)) +
+        " MB after", file=sys.stderr)
+    return crime_data
+
+
+def update_crime_store(year_min, year_max, block_index, geocode_cache=None, \
+    store=CHICAGO_CRIME_STORE):
+
+    '''
+    Bring the local crime store up to date with the city's data portal. Each
+    year keeps a high-water mark of the latest update it has seen, so only
+    records created or changed since the last run are requested. A store
+    written under another schema version is rebuilt from scratch.
+
+    Records stream through the store one page at a time: each page is
+    parsed, cast, and located among block groups, then pages are regrouped
+    and upserted into their partitions. The first pull of a year is ordered
+    on date and regrouped by month, so no more than a month of records is
+    held at once. Later pulls are ordered on the update time, which moves
+    with the high-water mark, so that records changed while pages are
+    requested land after the last page rather than shifting the offsets of
+    those before; they are regrouped in batches of rows. Records whose date
+    moved to this year leave the partitions of the year they were in.
+
+    year_min (int): lower-bound inclusive year for request.
+    year_max (int): upper-bound inclusive year for request.
+    block_index (BlockGroupIndex): spatial index over blocks.
+    geocode_cache (GeocodeCache): locations already known, if any.
+    store (str): directory of the crime store.
+
+    Return number of records upserted (int).
+
+    '''
+
+    if not crime_store_is_current(store) and os.path.isdir(store):
+        shutil.rmtree(store)
+    relocate_crime_store(block_index, geocode_cache, store)
+    manifest = read_crime_manifest(store)
+    manifest["geometry_version"] = block_index.version
+    id_index = index_crime_store_ids(store)
+    num_records = 0
+    for year in range(year_min, year_max + 1):
+        watermark = manifest["watermarks"].get(str(year))
+        pages = iterate_soap_pages(
+            CRIME_DATA_API,
+            {"$where": set_crime_store_filter(year, watermark)},
+            order="updated_on, :id" if watermark else "date, :id")
+        chunks = (
+            parse_crime_page(page, block_index, geocode_cache)
+            for page in pages)
+        batches = batch_crime_by_rows(chunks) if watermark \
+            else batch_crime_by_month(chunks)
+        for new_crime_data in batches:
+            with PIPELINE_TRACE.stage("upsert_crime_partitions", \
+                rows_in=len(new_crime_data), tally=True):
+                evict_moved_crime(new_crime_data, year, id_index, store)
+                upsert_crime_partitions(new_crime_data, year, store)
+            watermark = max(
+                [watermark, find_crime_watermark(new_crime_data)],
+                key=lambda mark: (mark["updated_on"], mark["id"]) \
+                    if mark else ("", 0))
+            num_records += len(new_crime_data)
+        manifest["watermarks"][str(year)] = watermark
+        write_crime_manifest(manifest, store)
+    return num_records
+
+
+def parse_crime_page(page, block_index, geocode_cache=None):
+
+    '''
+    Parse one page of crime records from the city's data portal, cast it to
+    the types of the crime store, and locate it among block groups. Each step
+    is tallied in the pipeline trace across pages.
+
+    page (lst): records from the city's data portal.
+    block_index (BlockGroupIndex): spatial index over blocks.
+    geocode_cache (GeocodeCache): locations already known, if any.
+
+    Return crime data (DataFrame).
+
+    '''
+
+    trace = PIPELINE_TRACE
+    with trace.stage("cast_crime_data", rows_in=len(page), tally=True):
+        crime_data = cast_crime_data(pd.DataFrame(page))
+    with trace.stage("locate_crime_data", rows_in=len(crime_data), \
+        tally=True) as stage:
+        crime_data = locate_crime_data(crime_data, block_index, geocode_cache)
+        stage["rows_out"] = int(crime_data["block_group"].notna().sum())
+    return crime_data
+
+
+def locate_crime_data(crime_data, block_index, geocode_cache=None):
+
+    '''
+    Locate crime records among block groups as they enter the crime store,
+    keeping those outside of every block group.
+
+    crime_data (DataFrame): records cast to the types of the crime store.
+    block_index (BlockGroupIndex): spatial index over blocks.
+    geocode_cache (GeocodeCache): locations already known, if any.
+
+    Return crime data (DataFrame).
+
+    '''
+
+    crime_data["block_group"] = locate_block_groups(crime_data, None, \
+        block_index=block_index, geocode_cache=geocode_cache)
+    return crime_data
+
+
+def batch_crime_by_month(chunks):
+
+    '''
+    Regroup a stream of crime records ordered on date into one batch for each
+    month.
+
+    chunks (iterable): crime records (DataFrame) ordered on date.
+
+    Yield crime records of one month (DataFrame).
+
+    '''
+
+    batch, batch_month = [], None
+    for chunk in chunks:
+        months = chunk["date"].dt.strftime("%Y-%m")
+        for month, records in chunk.groupby(months, sort=False):
+            if batch and month != batch_month:
+                yield pd.concat(batch, ignore_index=True)
+                batch = []
+            batch.append(records)
+            batch_month = month
+    if batch:
+        yield pd.concat(batch, ignore_index=True)
+
+
+def batch_crime_by_rows(chunks, batch_rows=CRIME_UPSERT_BATCH_ROWS):
+
+    '''
+    Regroup a stream of crime records in any order into batches of about
+    some number of rows.
+
+    chunks (iterable): crime records (DataFrame).
+    batch_rows (int): number of rows after which a batch is complete.
+
+    Yield crime records (DataFrame).
+
+    '''
+
+    batch, num_rows = [], 0
+    for chunk in chunks:
+        batch.append(chunk)
+        num_rows += len(chunk)
+        if num_rows >= batch_rows:
+            yield pd.concat(batch, ignore_index=True)
+            batch, num_rows = [], 0
+    if batch:
+        yield pd.concat(batch, ignore_index=True)
+
+
+def relocate_crime_store(block_index, geocode_cache=None, \
+    store=CHICAGO_CRIME_STORE):
+
+    '''
+    Locate every record of the crime store among block groups again if the
+    store was located against other block group geometries.
+
+    block_index (BlockGroupIndex): spatial index over blocks.
+    geocode_cache (GeocodeCache): locations already known, if any.
+    store (str): directory of the crime store.
+
+    Return None.
+
+    '''
+
+    manifest = read_crime_manifest(store)
+    if not os.path.isdir(store) \
+        or manifest.get("geometry_version") == block_index.version:
+        return
+    for path in glob.glob(crime_partition_path("*", "*", store)):
+        crime_data = locate_crime_data(read_parquet_cache(path), block_index, \
+            geocode_cache)
+        write_parquet_cache(crime_data, path, row_group_size=CRIME_ROW_GROUP_SIZE)
+    manifest["geometry_version"] = block_index.version
+    write_crime_manifest(manifest, store)
+
+
+def set_crime_store_filter(year, watermark=None):
+
+    '''
+    Set the $where filter for records of one year that are newer than its
+    high-water mark. Ties on the update time break on the record identifier.
+
+    year (int): year of the records.
+    watermark (dict): latest "updated_on" and "id" seen, if any.
+
+    Return filter (str).
+
+    '''
+
+    where = "year = " + str(year)
+    if watermark:
+        where += " AND (updated_on > '{0}' OR (updated_on = '{0}' AND " \
+            "id > {1}))".format(watermark["updated_on"], watermark["id"])
+    return where
+
+
+def cast_crime_data(crime_data):
+
+    '''
+    Cast crime records from the city's data portal to the types of the crime
+    store, dropping fields outside of its schema.
+
+    crime_data (DataFrame): records from the city's data portal.
+
+    Return crime data (DataFrame).
+
+    '''
+
+    crime_data = crime_data.reindex(columns=list(CRIME_SCHEMA))
+    for column, dtype in CRIME_SCHEMA.items():
+        if dtype.startswith("datetime"):
+            crime_data[column] = pd.to_datetime(crime_data[column])
+        elif dtype == "bool":
+            crime_data[column] = crime_data[column] \
+                .astype(str) \
+                .str.lower() == "true"
+        elif dtype != "object":
+            crime_data[column] = pd.to_numeric(crime_data[column]) \
+                .astype(dtype)
+    return crime_data
+
+
+def find_crime_watermark(crime_data):
+
+    '''
+    Find the high-water mark of a batch of crime records.
+
+    crime_data (DataFrame): records cast to the types of the crime store.
+
+    Return latest "updated_on" and "id" seen (dict).
+
+    '''
+
+    updated_on = crime_data["updated_on"].max()
+    latest = crime_data.loc[crime_data["updated_on"] == updated_on, "id"] \
+        .max()
+    return {
+        "updated_on": updated_on.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3],
+        "id": int(latest)}
+
+
+def upsert_crime_partitions(crime_data, year, store=CHICAGO_CRIME_STORE):
+
+    '''
+    Insert new records into, and replace changed records in, the monthly
+    partitions of one year of the crime store. Records whose date moved to
+    another month leave their old partition. Partitions are sorted on primary
+    type in small row groups so that reads can skip the crimes they filter.
+
+    crime_data (DataFrame): new or changed records for the year.
+    year (int): year of the records.
+    store (str): directory of the crime store.
+
+    Return None.
+
+    '''
+
+    months = crime_data["date"].dt.strftime("%Y-%m")
+    changed_ids = set(crime_data["id"])
+    partitions = {
+        os.path.basename(path)[:-len(".parquet")]: path
+        for path in glob.glob(crime_partition_path(year, "*", store))}
+    for month in set(partitions).union(months):
+        new_records = crime_data[months == month]
+        if month in partitions:
+            old_ids = pd.read_parquet(partitions[month], columns=["id"])["id"]
+            if new_records.empty and changed_ids.isdisjoint(old_ids):
+                continue
+            old_records = pd.read_parquet(partitions[month])
+            new_records = pd.concat([
+                old_records[~old_records["id"].isin(changed_ids)],
+                new_records], ignore_index=True, sort=False)
+        path = crime_partition_path(year, month, store)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_parquet_cache(
+            new_records.sort_values(["primary_type", "date"]), path,
+            row_group_size=CRIME_ROW_GROUP_SIZE)
+
+
+def index_crime_store_ids(store=CHICAGO_CRIME_STORE):
+
+    '''
+    Index the identifiers of the records in the crime store on the partition
+    that holds each, reading only the identifiers, so that records whose
+    date moved to another year can be found without reading every partition
+    for every batch.
+
+    store (str): directory of the crime store.
+
+    Return identifiers (CrimeIdIndex).
+
+    '''
+
+    paths = sorted(glob.glob(crime_partition_path("*", "*", store)))
+    ids = [
+        pd.read_parquet(path, columns=["id"])["id"].to_numpy(dtype=np.int64)
+        for path in paths]
+    partitions = np.repeat(
+        np.arange(len(paths), dtype=np.int32), [len(part) for part in ids])
+    ids = np.concatenate([np.empty(0, dtype=np.int64)] + ids)
+    order = np.argsort(ids, kind="stable")
+    id_index = CrimeIdIndex(
+        ids=ids[order],
+        partitions=partitions[order],
+        paths=paths)
+    return id_index
+
+
+def evict_moved_crime(crime_data, year, id_index, store=CHICAGO_CRIME_STORE):
+
+    '''
+    Remove the earlier copies of records whose date moved to this year from
+    the partitions of other years that held them when the update began.
+
+    crime_data (DataFrame): new or changed records for the year.
+    year (int): year of the records.
+    id_index (CrimeIdIndex): identifiers of the records in the store.
+    store (str): directory of the crime store.
+
+    Return None.
+
+    '''
+
+    if not len(id_index.ids) or crime_data.empty:
+        return
+    ids = crime_data["id"].to_numpy(dtype=np.int64)
+    positions = np.minimum(np.searchsorted(id_index.ids, ids), \
+        len(id_index.ids) - 1)
+    found = id_index.ids[positions] == ids
+    year_store = os.path.join(store, str(year))
+    for partition in np.unique(id_index.partitions[positions[found]]):
+        path = id_index.paths[partition]
+        if os.path.dirname(path) == year_store or not os.path.exists(path):
+            continue
+        old_records = pd.read_parquet(path)
+        moved = old_records["id"].isin(ids)
+        if not moved.any():
+            continue
+        if moved.all():
+            os.remove(path)
+        else:
+            write_parquet_cache(old_records[~moved], path, \
+                row_group_size=CRIME_ROW_GROUP_SIZE)
+
+
+def read_crime_store(year_min, year_max, store=CHICAGO_CRIME_STORE, \
+    columns=None, crimes=None):
+
+    '''
+    Read the monthly partitions of the crime store for some years. Only the
+    partitions of those years are opened, only the columns desired are read,
+    and row groups without the crimes desired are skipped.
+
+    year_min (int): lower-bound inclusive year.
+    year_max (int): upper-bound inclusive year.
+    store (str): directory of the crime store.
+    columns (lst): columns to read, or all if None.
+    crimes (lst): primary types to read, or all if None.
+
+    Return crime data (DataFrame).
+
+    '''
+
+    partitions = list(
+        iterate_crime_store(year_min, year_max, store, columns, crimes))
+    if not partitions:
+        return pd.DataFrame({
+            column: pd.Series(dtype=CRIME_SCHEMA.get(column, "object"))
+            for column in (columns or CRIME_SCHEMA)})
+    crime_data = pd.concat(partitions, ignore_index=True, sort=False)
+    return crime_data
+
+
+def iterate_crime_store(year_min, year_max, store=CHICAGO_CRIME_STORE, \
+    columns=None, crimes=None):
+
+    '''
+    Read the monthly partitions of the crime store for some years one at a
+    time, in order. Only the columns desired are read, row groups without
+    the crimes desired are skipped, and stale partitions are passed over.
+
+    year_min (int): lower-bound inclusive year.
+    year_max (int): upper-bound inclusive year.
+    store (str): directory of the crime store.
+    columns (lst): columns to read, or all if None.
+    crimes (lst): primary types to read, or all if None.
+
+    Yield crime data of one month (DataFrame).
+
+    '''
+
+    filters = None
+    if crimes is not None:
+        filters = [("primary_type", "in", [crime.upper() for crime in crimes])]
+    paths = sorted(
+        path
+        for year in range(year_min, year_max + 1)
+        for path in glob.glob(crime_partition_path(year, "*", store)))
+    for path in paths:
+        crime_data = read_parquet_cache(path, columns=columns, filters=filters)
+        if crime_data is not None:
+            yield crime_data
+
+
+def crime_partition_path(year, month, store=CHICAGO_CRIME_STORE):
+
+    '''
+    Locate the partition of the crime store for one month, i.e. 2017-07.
+
+    year (int): year of the partition.
+    month (str): year and month of the partition, or a glob pattern.
+    store (str): directory of the crime store.
+
+    Return path (str).
+
+    '''
+
+    return os.path.join(store, str(year), month + ".parquet")
+
+
+def crime_store_is_current(store=CHICAGO_CRIME_STORE):
+
+    '''
+    Check whether the crime store exists under the current schema version.
+
+    store (str): directory of the crime store.
+
+    Return whether the store is current (bool).
+
+    '''
+
+    return os.path.isdir(store) \
+        and read_crime_manifest(store)["schema_version"] == CACHE_SCHEMA_VERSION
+
+
+def read_crime_manifest(store=CHICAGO_CRIME_STORE):
+
+    '''
+    Read the schema version and high-water marks by year of the crime store.
+    A store without a manifest predates schema versions.
+
+    store (str): directory of the crime store.
+
+    Return manifest (dict).
+
+    '''
+
+    path = os.path.join(store, CHICAGO_CRIME_MANIFEST)
+    if not os.path.exists(path):
+        return {
+            "schema_version": 0 if os.path.isdir(store) else CACHE_SCHEMA_VERSION,
+            "watermarks": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_crime_manifest(manifest, store=CHICAGO_CRIME_STORE):
+
+    '''
+    Write the schema version and high-water marks by year of the crime store.
+
+    manifest (dict): schema version and latest "updated_on" and "id" by year.
+    store (str): directory of the crime store.
+
+    Return None.
+
+    '''
+
+    os.makedirs(store, exist_ok=True)
+    with open(os.path.join(store, CHICAGO_CRIME_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def write_parquet_cache(data, path, geometry=None, row_group_size=None, \
+    metadata=None):
+
+    '''
+    Write a typed table to a Parquet cache stamped with the schema version.
+    Geometries are stored as WKB.
+
+    data (DataFrame): table to cache.
+    path (str): location of the cache.
+    geometry (str): name of the geometry column, if any.
+    row_group_size (int): maximum number of rows in each row group.
+    metadata (dict): other stamps that readers must match, if any.
+
+    Return None.
+
+    '''
+
+    data = pd.DataFrame(data)
+    if geometry:
+        data[geometry] = gpd.GeoSeries(data[geometry]).to_wkb()
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    table = table.replace_schema_metadata(dict(
+        table.schema.metadata or {},
+        schema_version=str(CACHE_SCHEMA_VERSION),
+        **(metadata or {})))
+    pq.write_table(table, path, row_group_size=row_group_size)
+
+
+def read_parquet_cache(path, columns=None, filters=None, geometry=None, \
+    metadata=None):
+
+    '''
+    Read a typed table from a Parquet cache, if it exists under the current
+    schema version and carries every other stamp expected.
+
+    path (str): location of the cache.
+    columns (lst): columns to read, or all if None.
+    filters (lst): predicates on columns to push down to the reader.
+    geometry (str): name of the geometry column, if any.
+    metadata (dict): other stamps expected, if any.
+
+    Return table (DataFrame or GeoDataFrame), or None if missing or stale.
+
+    '''
+
+    if not os.path.exists(path):
+        return None
+    stamps = pq.read_schema(path).metadata or {}
+    expected = dict(metadata or {}, schema_version=str(CACHE_SCHEMA_VERSION))
+    if any(stamps.get(key.encode()) != value.encode()
+            for key, value in expected.items()):
+        return None
+    data = pd.read_parquet(path, columns=columns, filters=filters)
+    if geometry:
+        data[geometry] = gpd.GeoSeries.from_wkb(data[geometry])
+        data = gpd.GeoDataFrame(data).set_geometry(geometry)
+    return data
+
+
+def compile_census_data(variable_dicts, rebuild=False, vintages=(ACS_YEAR,), \
+    dataset=ACS_DATASET):
+
+    '''
+    Compile Cook County data from US Census Bureau's American Community Survey
+    into a demographic store keyed by vintage and block group. Themes of every
+    vintage are requested concurrently and cached one by one, so adding a
+    theme or a vintage neither delays the others nor invalidates their caches.
+    Published vintages do not change, so a theme cached once is not
+    requested again.
+
+    variable_dicts (lst): collection of dictionaries of variables desired.
+    rebuild (bool): whether to rerequest themes even if they are cached.
+    vintages (lst): vintages of the survey.
+    dataset (str): survey, i.e. acs5 for five-year estimates.
+
+    Return census data indexed by vintage and block group (DataFrame).
+    
+    '''
+
+    requests_desired = [
+        (variable_dict, vintage)
+        for vintage in vintages
+        for variable_dict in variable_dicts]
+    max_workers = max(len(requests_desired), 1)
+    session = create_http_session(max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        themes = list(executor.map(
+            lambda desired: compile_census_theme(
+                desired[0], desired[1], dataset, rebuild, session),
+            requests_desired))
+    session.close()
+    census_data = merge_census_themes({
+        vintage: themes[i:i + len(variable_dicts)]
+        for i, vintage in zip(
+            range(0, len(themes), len(variable_dicts)), vintages)})
+    return census_data
+
+
+def merge_census_themes(themes):
+
+    '''
+    Merge the demographic themes of each vintage on block group and stack the
+    vintages into one demographic store.
+
+    themes (dict): themes (lst of DataFrame) by vintage.
+
+    Return census data indexed by vintage and block group (DataFrame).
+
+    '''
+
+    census_data = pd.concat([
+        reduce(
+            lambda left, right: left.merge(right, how="outer", on="block_group"),
+            vintage_themes) \
+            .assign(vintage=vintage)
+        for vintage, vintage_themes in themes.items()],
+        ignore_index=True, sort=False)
+    census_data = census_data \
+        .set_index(["vintage", "block_group"]) \
+        .sort_index()
+    return census_data
+
+
+def compile_census_theme(variable_dict, year=ACS_YEAR, dataset=ACS_DATASET, \
+    rebuild=False, session=None):
+
+    '''
+    Compile one demographic theme of ACS data for Cook County block groups,
+    cached by vintage, survey, and variables, and requested only if the
+    cache is missing or stale.
+
+    variable_dict (dict): collection of variables for one demographic theme.
+    year (int): vintage of the survey.
+    dataset (str): survey, i.e. acs5 for five-year estimates.
+    rebuild (bool): whether to rerequest even if the theme is cached.
+    session (Session): pooled HTTP session, if any.
+
+    Return census data (DataFrame).
+
+    '''
+
+    LOCATION_VARIABLES = ["state", "county", "tract", "block group"]
+    variables = hashlib.sha1(json.dumps(variable_dict, sort_keys=True).encode())
+    path = os.path.join(CENSUS_DATA_CACHE, "-".join(
+        [dataset, str(year), variables.hexdigest()[:12]]) + ".parquet")
+    if not rebuild:
+        census_data = read_parquet_cache(path)
+        if census_data is not None:
+            return census_data
+    census_data = request_census_data(variable_dict, year, dataset, session)
+    census_data["block_group"] = census_data["state"] \
+        .str.cat(census_data[LOCATION_VARIABLES[1:]])
+    census_data = census_data \
+        .drop(columns=LOCATION_VARIABLES) \
+        .set_index("block_group") \
+        .astype(float) \
+        .reset_index()
+    os.makedirs(CENSUS_DATA_CACHE, exist_ok=True)
+    write_parquet_cache(census_data, path)
+    return census_data
+
+
+def request_census_data(variable_dict, year=ACS_YEAR, dataset=ACS_DATASET, \
+    session=None):
+
+    '''
+    Request Cook County ACS data from Census Bureau's API.
+
+    variable_dict (dict): collection of variables for one demographic theme.
+    year (int): vintage of the survey.
+    dataset (str): survey, i.e. acs5 for five-year estimates.
+    session (Session): pooled HTTP session, if any.
+
+    Return census data (DataFrame).
+
+    '''
+
+    census_data = request_with_retry(
+        session or requests.Session(),
+        ACS_API.format(year=year, dataset=dataset),
+        set_census_data_params(variable_dict))
+    labels = [variable_dict.get(var, var) for var in census_data.pop(0)]
+    census_data = pd.DataFrame(census_data, columns=labels)
+    census_data = normalize_census_data_variables(census_data, variable_dict)
+    return census_data
+
+
+def set_census_data_params(variable_dict):
+
+    '''
+    Set parameters for next Census Bureau API request of ACS data.
+
+    variable_dict (dict): collection of demographic variables for one theme, 
+    i.e. education, income, race.
+
+    Return parameters (dict).
+
+    '''
+
+    parameters = {
+        "get": ",".join(var for var in variable_dict.keys()),
+        "for": "block group:*",
+        "in": "state:17 county:031"} # Cook County, Illinois
+    return parameters
+
+
+def normalize_census_data_variables(census_data, variable_dict):
+
+    '''
+    Convert demographic variables into proportion of their themes, i.e.
+    education, income, race.
+
+    census_data (DataFrame): data from Census Bureau API request.
+    variable_dict (dict): collection of demographic variables for one theme.
+
+    Return updated census data (DataFrame).
+
+    '''
+
+    columns, exclude = isolate_respondents_label(variable_dict.values())
+    normalized = census_data[columns] \
+        .astype(float) \
+        .div(census_data[exclude].astype(float), axis=0)
+    census_data = census_data.drop(columns=columns)
+    census_data = pd.concat([census_data, normalized], axis=1)
+    return census_data
+
+
+def isolate_respondents_label(labels):
+
+    '''
+    Identify the column that has the sum of respondents for a theme, i.e.
+    education, income, race.
+
+    labels (lst): column names for one theme.
+
+    Return demographic columns, sum column (tuple).
+
+    '''
+
+    regex = re.compile(r".*_respondents")
+    respondents = list(filter(regex.match, labels))[0]
+    columns = [col for col in labels if col != respondents]
+    return columns, respondents
+
+
+def match_census_vintages(years, vintages):
+
+    '''
+    Match years to the latest vintage of the survey no later than each, or to
+    the earliest vintage for years that precede all of them.
+
+    years (array): years to match, i.e. of criminal incidents.
+    vintages (lst): vintages of the survey available.
+
+    Return vintages (array).
+
+    '''
+
+    vintages = np.sort(np.asarray(vintages))
+    positions = np.searchsorted(vintages, years, side="right") - 1
+    return vintages[np.maximum(positions, 0)]
+
+
+def lookup_census_profiles(census_data, years, block_groups):
+
+    '''
+    Look up the demographic profiles of block groups in the vintages matched
+    to some years, with an index join on the demographic store.
+
+    census_data (DataFrame): census data indexed by vintage and block group.
+    years (array): year of each lookup.
+    block_groups (array): block group of each lookup.
+
+    Return demographic profiles in order of the lookups (DataFrame).
+
+    '''
+
+    vintages = match_census_vintages(years, census_data.index.levels[0])
+    keys = pd.MultiIndex.from_arrays(
+        [vintages, np.asarray(block_groups, dtype=object)],
+        names=census_data.index.names)
+    return census_data.reindex(keys)
+
+
+def join_crime_with_community_areas(crime_data, communities, block_index=None, \
+    community_index=None):
+
+    '''
+    Assign community areas to crime data by community area number through a
+    lookup array, in place of a merge. Incidents whose number is missing or
+    unknown fall back to the community area that contains their block group.
+    No incidents are dropped: those with neither keep a missing community.
+
+    crime_data (DataFrame): crime data from Chiago's data portal.
+    communities (DataFrame): community areas.
+    block_index (BlockGroupIndex): spatial index over blocks, for the fallback.
+    community_index (CommunityIndex): prebuilt lookups, if any.
+
+    Return join (DataFrame).
+
+    '''
+
+    if community_index is None:
+        community_index = build_community_index(communities, block_index)
+    areas = pd.to_numeric(crime_data["community_area"], errors="coerce") \
+        .to_numpy(dtype=float)
+    known = (areas >= 0) & (areas < len(community_index.by_area))
+    codes = np.full(len(crime_data), -1, dtype=np.int16)
+    codes[known] = community_index.by_area[areas[known].astype(int)]
+    missing = np.flatnonzero(codes < 0)
+    if len(missing) and "block_group" in crime_data:
+        positions = community_index.block_groups.get_indexer(
+            crime_data["block_group"].to_numpy()[missing])
+        codes[missing] = np.where(
+            positions >= 0,
+            community_index.by_block_group[np.maximum(positions, 0)],
+            -1)
+    crime_data["community"] = pd.Categorical.from_codes(
+        codes, categories=community_index.communities)
+    return crime_data
+
+
+def build_community_index(communities, block_index=None):
+
+    '''
+    Build lookups to the position of a community area from its number, and
+    from any block group to the community area that contains a point on its
+    surface. Containment is computed once here for every block group.
+
+    communities (DataFrame): community areas.
+    block_index (BlockGroupIndex): spatial index over blocks, if any.
+
+    Return lookups (CommunityIndex).
+
+    '''
+
+    areas = pd.to_numeric(communities["area_num_1"]).to_numpy(dtype=int)
+    by_area = np.full(areas.max() + 1, -1, dtype=np.int16)
+    by_area[areas] = np.arange(len(areas))
+    block_groups = np.empty(0, dtype=object)
+    by_block_group = np.empty(0, dtype=np.int16)
+    if block_index is not None:
+        points = shapely.point_on_surface(block_index.tree.geometries)
+        tree = shapely.STRtree(np.asarray(communities.geometry.values))
+        inside, community = tree.query(points, predicate="within")
+        block_groups = block_index.block_groups
+        by_block_group = np.full(len(points), -1, dtype=np.int16)
+        by_block_group[inside] = community
+    community_index = CommunityIndex(
+        communities=communities["community"].to_numpy(),
+        by_area=by_area,
+        block_groups=pd.Index(block_groups),
+        by_block_group=by_block_group)
+    return community_index
+
+
+def join_crime_with_block_groups(crime_data, blocks, \
+    chunk_size=BLOCK_JOIN_CHUNK_SIZE, block_index=None, geocode_cache=None):
+
+    '''
+    Join crime data and block groups data on longitude, latitude. Incidents
+    outside of every block group are dropped.
+
+    crime_data (DataFrame): crime data from Chiago's data portal.
+    blocks (GeoDataFrame): block group data from Chicago's data portal.
+    chunk_size (int): number of locations to locate at once, or all if None.
+    block_index (BlockGroupIndex): prebuilt spatial index over blocks, if any.
+    geocode_cache (GeocodeCache): locations already known, if any.
+
+    Return join (DataFrame).
+
+    '''
+
+    block_groups = locate_block_groups(crime_data, blocks, chunk_size, \
+        block_index, geocode_cache)
+    located = pd.notna(block_groups)
+    joined_data = crime_data[located] \
+        .assign(block_group=block_groups[located])
+    return joined_data
+
+
+def locate_block_groups(crime_data, blocks, chunk_size=BLOCK_JOIN_CHUNK_SIZE, \
+    block_index=None, geocode_cache=None):
+
+    '''
+    Locate incidents among block groups on longitude, latitude. Each
+    distinct location is looked up in the geocode cache first, and only the
+    locations it has never seen are located among the block polygons, in
+    chunks so that their points never all exist at once. Incidents without
+    coordinates fall back to the block group usual for their block.
+
+    crime_data (DataFrame): crime data from Chiago's data portal.
+    blocks (GeoDataFrame): block group data, unless block_index is given.
+    chunk_size (int): number of locations to locate at once, or all if None.
+    block_index (BlockGroupIndex): prebuilt spatial index over blocks, if any.
+    geocode_cache (GeocodeCache): locations already known, if any.
+
+    Return block group of each incident, or None if outside of all (array).
+
+    '''
+
+    if block_index is None:
+        block_index = build_block_group_index(blocks)
+    if geocode_cache is None:
+        geocode_cache = GeocodeCache(None, block_index.version)
+    longitude = crime_data["longitude"].to_numpy(dtype=float)
+    latitude = crime_data["latitude"].to_numpy(dtype=float)
+    block_groups = np.full(len(crime_data), None, dtype=object)
+
+    # Look up every incident with coordinates in the cache.
+    point_rows = np.flatnonzero(np.isfinite(longitude) & np.isfinite(latitude))
+    keys = round_geocode_keys(longitude[point_rows], latitude[point_rows])
+    cached, found = geocode_cache.lookup_points(keys)
+    block_groups[point_rows[found]] = cached[found]
+
+    # Locate each location the cache has never seen once.
+    missed_rows = point_rows[~found]
+    missed_keys, first, inverse = np.unique(
+        keys[~found], return_index=True, return_inverse=True)
+    located_rows = missed_rows[first]
+    chunk_size = chunk_size or max(len(located_rows), 1)
+    positions = np.concatenate([np.empty(0, dtype=np.int64)] + [
+        assign_block_groups(
+            longitude[located_rows[start:start + chunk_size]],
+            latitude[located_rows[start:start + chunk_size]],
+            block_index)
+        for start in range(0, len(located_rows), chunk_size)])
+    located = np.where(
+        positions >= 0,
+        block_index.block_groups[np.maximum(positions, 0)],
+        None)
+    block_groups[missed_rows] = located[inverse.ravel()]
+    geocode_cache.update_points(missed_keys, located)
+
+    # Fall back to the block for incidents without coordinates.
+    if "block" in crime_data:
+        blocks_named = crime_data["block"].to_numpy()
+        geocode_cache.update_blocks(
+            blocks_named[point_rows], block_groups[point_rows])
+        block_rows = np.setdiff1d(np.arange(len(crime_data)), point_rows)
+        cached, found = geocode_cache.lookup_blocks(blocks_named[block_rows])
+        block_groups[block_rows[found]] = cached[found]
+    return block_groups
+
+
+def build_block_group_index(blocks):
+
+    '''
+    Build a spatial index over block polygons to reuse across joins. The
+    index carries a digest of the geometries that caches of locations check.
+
+    blocks (GeoDataFrame): block group data from Chicago's data portal.
+
+    Return spatial index (BlockGroupIndex).
+
+    '''
+
+    geometries = np.asarray(blocks.geometry.values)
+    version = hashlib.sha1()
+    for block_group, geometry in zip(blocks["block_group"], \
+        shapely.to_wkb(geometries)):
+        version.update(block_group.encode())
+        version.update(geometry)
+    if set(BOUNDS_COLUMNS).issubset(blocks.columns):
+        bounds = blocks[BOUNDS_COLUMNS].to_numpy()
+        bounds = np.concatenate([bounds[:, :2].min(axis=0), \
+            bounds[:, 2:].max(axis=0)])
+    else:
+        bounds = shapely.total_bounds(geometries)
+    block_index = BlockGroupIndex(
+        tree=shapely.STRtree(geometries),
+        block_groups=blocks["block_group"].to_numpy(),
+        bounds=bounds,
+        version=version.hexdigest())
+    return block_index
+
+
+def assign_block_groups(longitude, latitude, block_index):
+
+    '''
+    Locate points among block polygons. Points outside the bounding box of
+    every block are discarded before the batched point-in-polygon query. A
+    point on the border of blocks goes to the first of them.
+
+    longitude (array): longitudes of the points.
+    latitude (array): latitudes of the points.
+    block_index (BlockGroupIndex): spatial index over blocks.
+
+    Return positions of blocks in the index, or -1 if none (array).
+
+    '''
+
+    positions = np.full(len(longitude), -1, dtype=np.int64)
+    x_min, y_min, x_max, y_max = block_index.bounds
+    candidates = np.flatnonzero(
+        (longitude >= x_min) & (longitude <= x_max) &
+        (latitude >= y_min) & (latitude <= y_max))
+    points = shapely.points(longitude[candidates], latitude[candidates])
+    point_hits, block_hits = block_index.tree.query(points, \
+        predicate="intersects")
+    order = np.lexsort((block_hits, point_hits))
+    point_hits, block_hits = point_hits[order], block_hits[order]
+    first = np.unique(point_hits, return_index=True)[1]
+    positions[candidates[point_hits[first]]] = block_hits[first]
+    return positions
+
+
+def round_geocode_keys(longitude, latitude, precision=GEOCODE_PRECISION):
+
+    '''
+    Round coordinates and pack each pair into one integer key.
+
+    longitude (array): longitudes of the points.
+    latitude (array): latitudes of the points.
+    precision (int): number of decimal places to keep.
+
+    Return keys (array).
+
+    '''
+
+    scale = 10 ** precision
+    longitude = np.round(longitude * scale).astype(np.int64)
+    latitude = np.round((latitude + 90) * scale).astype(np.int64)
+    return longitude * (180 * scale + 1) + latitude
+
+
+class GeocodeCache:
+
+    '''
+    Persistent lookup of the block group of rounded coordinates, and of the
+    block group most usual for a block, for incidents without coordinates.
+    The cache belongs to one version of the block group geometries and
+    starts over when they change. Entries learned since the cache was loaded
+    are kept in dictionaries beside the tables loaded, and joined to them
+    only when the cache is saved, so that each page looks them up in time
+    that does not grow with the cache.
+
+    '''
+
+    def __init__(self, directory=GEOCODE_CACHE, version=None):
+
+        '''
+        Load the cache from disk, or start it empty.
+
+        directory (str): location of the cache, or None to keep it in memory.
+        version (str): digest of the block group geometries.
+
+        '''
+
+        self.directory = directory
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        points, blocks = None, None
+        if directory:
+            metadata = {"geometry_version": version}
+            points = read_parquet_cache(
+                os.path.join(directory, "points.parquet"), \
+                columns=["key", "block_group"], metadata=metadata)
+            blocks = read_parquet_cache(
+                os.path.join(directory, "blocks.parquet"), metadata=metadata)
+        if points is None:
+            points = pd.DataFrame({
+                "key": np.empty(0, dtype=np.int64),
+                "block_group": np.empty(0, dtype=object)})
+        if blocks is None:
+            blocks = pd.DataFrame({
+                "block": np.empty(0, dtype=object),
+                "block_group": np.empty(0, dtype=object)})
+        self.points = points.set_index("key")
+        self.blocks = blocks.set_index("block")
+        self.new_points = {}
+        self.new_blocks = {}
+
+    @property
+    def hit_rate(self):
+
+        '''
+        Share of lookups the cache has answered.
+
+        '''
+
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def lookup_points(self, keys):
+
+        '''
+        Look up the block groups of rounded coordinates.
+
+        keys (array): keys of rounded coordinates.
+
+        Return block groups, whether found (tuple).
+
+        '''
+
+        return self._lookup(self.points, self.new_points, keys)
+
+    def lookup_blocks(self, blocks):
+
+        '''
+        Look up the block groups most usual for blocks.
+
+        blocks (array): blocks, i.e. 021XX S MICHIGAN AVE.
+
+        Return block groups, whether found (tuple).
+
+        '''
+
+        return self._lookup(self.blocks, self.new_blocks, blocks)
+
+    def update_points(self, keys, block_groups):
+
+        '''
+        Remember the block groups of rounded coordinates not yet cached,
+        including those outside of every block group.
+
+        keys (array): keys of rounded coordinates.
+        block_groups (array): block groups, or None if outside of all.
+
+        Return None.
+
+        '''
+
+        self.new_points.update(zip(np.asarray(keys).tolist(), block_groups))
+
+    def update_blocks(self, blocks, block_groups):
+
+        '''
+        Remember the block group most usual for blocks not yet cached.
+
+        blocks (array): blocks of located incidents.
+        block_groups (array): block groups of located incidents.
+
+        Return None.
+
+        '''
+
+        new_blocks = pd.DataFrame({"block": blocks, "block_group": block_groups}) \
+            .dropna()
+        _, found = self._lookup(self.blocks, self.new_blocks, \
+            new_blocks["block"].to_numpy(), count=False)
+        new_blocks = new_blocks[~found] \
+            .groupby(["block", "block_group"]) \
+            .size() \
+            .reset_index(name="incidents") \
+            .sort_values(by="incidents", kind="mergesort") \
+            .drop_duplicates(subset="block", keep="last")
+        self.new_blocks.update(
+            zip(new_blocks["block"], new_blocks["block_group"]))
+
+    def save(self):
+
+        '''
+        Join the entries learned to the tables of the cache, and write them
+        to disk, stamped with the version of the block group geometries.
+
+        Return None.
+
+        '''
+
+        for table, new in [("points", self.new_points), \
+            ("blocks", self.new_blocks)]:
+            if new:
+                cached = getattr(self, table)
+                setattr(self, table, pd.concat([
+                    cached,
+                    pd.Series(list(new.values()), \
+                        index=pd.Index(list(new), name=cached.index.name), \
+                        dtype=object, name="block_group").to_frame()]))
+                new.clear()
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        metadata = {"geometry_version": self.version}
+        write_parquet_cache(self.points.reset_index(),
+            os.path.join(self.directory, "points.parquet"), metadata=metadata)
+        write_parquet_cache(self.blocks.reset_index(),
+            os.path.join(self.directory, "blocks.parquet"), metadata=metadata)
+
+    def _lookup(self, table, new, keys, count=True):
+
+        '''
+        Look up keys in one table of the cache, then in the entries learned
+        since it was loaded, and count hits and misses.
+
+        table (DataFrame): table of the cache indexed on its keys.
+        new (dict): block groups learned since, by key.
+        keys (array): keys to look up.
+        count (bool): whether to count hits and misses.
+
+        Return block groups, whether found (tuple).
+
+        '''
+
+        keys = np.asarray(keys)
+        positions = table.index.get_indexer(keys)
+        found = positions >= 0
+        block_groups = np.full(len(keys), None, dtype=object)
+        cached = table["block_group"].to_numpy(dtype=object)
+        block_groups[found] = cached[positions[found]]
+        if new:
+            for row in np.flatnonzero(~found):
+                key = keys[row].item() if keys.dtype != object else keys[row]
+                if key in new:
+                    block_groups[row] = new[key]
+                    found[row] = True
+        if count:
+            self.hits += int(found.sum())
+            self.misses += int((~found).sum())
+        return block_groups, found
+
+
+def build_crime_cubes(crime_data, time_index=None, window=None, max_workers=1):
+
+    '''
+    Count incidents in one pass over crime data by year, month, week, primary
+    type, community area, and block group, then roll that cube up into the
+    smaller cubes that the report sections read. Weeks end on Monday.
+    Incidents without a community area are counted under a missing one.
+    Large crime data is counted by partition across processes.
+
+    crime_data (DataFrame): crime data joined with communities and blocks.
+    time_index (CrimeTimeIndex): index over the dates of crime data, if any.
+    window (TimeWindow): time window to count incidents in, or all if None.
+    max_workers (int): number of processes counting at once, or all cores.
+
+    Return incidents by each rollup in CRIME_CUBE_ROLLUPS (dict).
+
+    '''
+
+    if window is not None:
+        crime_data = crime_data.take(select_time_window(time_index, window))
+    if max_workers != 1 and len(crime_data) >= CRIME_CUBE_PARALLEL_MIN_ROWS:
+        crime_cube = count_crime_partitions(crime_data, max_workers)
+    else:
+        date = crime_data["date"].dt.normalize()
+        crime_cube = crime_data \
+            .assign(
+                month=date.dt.month,
+                week=date + pd.to_timedelta((7 - date.dt.weekday) % 7, unit="D")) \
+            .groupby(CRIME_CUBE_DIMENSIONS, observed=True, dropna=False) \
+            .size() \
+            .rename("incidents")
+    crime_cubes = {
+        rollup: crime_cube \
+            .groupby(level=dimensions, observed=True, dropna=False) \
+            .sum() \
+            .reset_index()
+        for rollup, dimensions in CRIME_CUBE_ROLLUPS.items()}
+    return crime_cubes
+
+
+def count_crime_partitions(crime_data, max_workers=None):
+
+    '''
+    Count incidents by every dimension of the cube, partitioned by primary
+    type and year across a pool of processes. Columns are written once as
+    NumPy buffers that the workers map read-only, rather than pickling a
+    frame to each; categories travel as their codes, and are restored on
+    the counts gathered.
+
+    crime_data (DataFrame): crime data joined with communities and blocks.
+    max_workers (int): number of processes counting at once, or all cores.
+
+    Return incidents by CRIME_CUBE_DIMENSIONS (Series).
+
+    '''
+
+    categories = {
+        column: crime_data[column].astype("category").cat
+        for column in CRIME_PARTITION_CODES}
+    year = crime_data["year"].to_numpy()
+    order = np.lexsort((year, categories["primary_type"].codes.to_numpy()))
+    columns = {
+        "date": crime_data["date"].to_numpy(dtype="datetime64[ns]")[order],
+        "year": year[order]}
+    for column, values in categories.items():
+        columns[column] = values.codes.to_numpy()[order]
+    keys = np.stack([columns["primary_type"], columns["year"]])
+    bounds = np.append(
+        np.flatnonzero(np.any(keys[:, 1:] != keys[:, :-1], axis=0)) + 1,
+        len(order))
+    starts = np.insert(bounds[:-1], 0, 0)
+    with tempfile.TemporaryDirectory(prefix="chicago-crime-") as directory:
+        for column, values in columns.items():
+            np.save(os.path.join(directory, column + ".npy"), values)
+        del columns, keys
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            counts = list(executor.map(count_crime_partition, \
+                [directory] * len(starts), starts, bounds))
+    counts = pd.concat(counts, ignore_index=True)
+    for column, values in categories.items():
+        counts[column] = pd.Categorical.from_codes(counts[column], \
+            values.categories, values.ordered)
+    return counts \
+        .astype({"year": crime_data["year"].dtype, "month": "int32"}) \
+        .groupby(CRIME_CUBE_DIMENSIONS, observed=True, dropna=False) \
+        ["incidents"] \
+        .sum()
+
+
+def count_crime_partition(directory, start, stop):
+
+    '''
+    Count the incidents of one partition by every dimension of the cube,
+    from NumPy buffers mapped read-only. Weeks end on Monday.
+
+    directory (str): location of the buffers, one per column.
+    start (int): position of the first incident of the partition.
+    stop (int): position after the last incident of the partition.
+
+    Return incidents by CRIME_CUBE_DIMENSIONS, categories as codes (DataFrame).
+
+    '''
+
+    columns = {
+        column: np.load(os.path.join(directory, column + ".npy"), \
+            mmap_mode="r")[start:stop]
+        for column in ["date", "year"] + CRIME_PARTITION_CODES}
+    days = columns.pop("date").astype("datetime64[D]")
+    # The epoch fell on a Thursday, day 3 of a week starting on Monday.
+    weekdays = (days.astype(np.int64) + 3) % 7
+    columns["month"] = days.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    columns["week"] = (days + (7 - weekdays) % 7).astype("datetime64[ns]")
+    return pd.DataFrame(columns) \
+        .groupby(CRIME_CUBE_DIMENSIONS, dropna=False) \
+        .size() \
+        .rename("incidents") \
+        .reset_index()
+
+
+def build_crime_time_index(crime_data):
+
+    '''
+    Index crime data sorted on date for selection of time windows. Dates are
+    searched in order, and positions of the incidents on each day of the week
+    and hour of the day are kept in order too, bucketed by the day or hour.
+
+    crime_data (DataFrame): crime data sorted on date.
+
+    Return time index (CrimeTimeIndex).
+
+    '''
+
+    dates = crime_data["date"].to_numpy(dtype="datetime64[ns]")
+    weekdays = crime_data["date"].dt.weekday.to_numpy(dtype=np.int8)
+    hours = crime_data["date"].dt.hour.to_numpy(dtype=np.int8)
+    weekday_order = np.argsort(weekdays, kind="stable")
+    hour_order = np.argsort(hours, kind="stable")
+    time_index = CrimeTimeIndex(
+        dates=dates,
+        weekdays=weekdays,
+        hours=hours,
+        weekday_order=weekday_order,
+        weekday_offsets=np.searchsorted(weekdays[weekday_order], np.arange(8)),
+        hour_order=hour_order,
+        hour_offsets=np.searchsorted(hours[hour_order], np.arange(25)))
+    return time_index
+
+
+def select_time_window(time_index, window):
+
+    '''
+    Select the positions of the incidents in a time window by binary search.
+    Dates between start and end, and months of the year across years, are
+    searched over the sorted dates. Days of the week or hours of the day are
+    then searched within their buckets; if both are desired, hours filter
+    the incidents selected on those days.
+
+    time_index (CrimeTimeIndex): index over the dates of crime data.
+    window (TimeWindow): inclusive start and exclusive end dates, months of
+    the year (1-12), days of the week (0 is Monday), hours of the day (0-23),
+    each unbounded if None.
+
+    Return positions of the incidents in crime data, in order (array).
+
+    '''
+
+    dates = time_index.dates
+    if not len(dates):
+        return np.empty(0, dtype=np.int64)
+    first = 0 if window.start is None \
+        else np.searchsorted(dates, np.datetime64(window.start, "ns"))
+    last = len(dates) if window.end is None \
+        else np.searchsorted(dates, np.datetime64(window.end, "ns"))
+    intervals = [(first, last)]
+    if window.months is not None:
+        years = range(
+            dates[0].astype("datetime64[Y]").astype(int) + 1970,
+            dates[-1].astype("datetime64[Y]").astype(int) + 1971)
+        starts = np.array([
+            np.datetime64(str(year) + "-" + str(month).zfill(2), "M")
+            for year in years
+            for month in sorted(set(window.months))])
+        bounds = np.searchsorted(dates, np.stack(
+            [starts, starts + np.timedelta64(1, "M")]).astype("datetime64[ns]"))
+        intervals = [
+            (max(start, first), min(end, last))
+            for start, end in bounds.T
+            if min(end, last) > max(start, first)]
+    if window.weekdays is not None:
+        buckets = time_index.weekday_order, time_index.weekday_offsets, \
+            window.weekdays
+    elif window.hours is not None:
+        buckets = time_index.hour_order, time_index.hour_offsets, window.hours
+    else:
+        return np.concatenate([np.empty(0, dtype=np.int64)] + [
+            np.arange(start, end) for start, end in intervals])
+    order, offsets, keys = buckets
+    positions = []
+    for key in sorted(set(keys)):
+        bucket = order[offsets[key]:offsets[key + 1]]
+        for start, end in intervals:
+            positions.append(bucket[
+                np.searchsorted(bucket, start):np.searchsorted(bucket, end)])
+    positions = np.sort(np.concatenate(
+        [np.empty(0, dtype=np.int64)] + positions))
+    if window.weekdays is not None and window.hours is not None:
+        positions = positions[np.isin(time_index.hours[positions], window.hours)]
+    return positions
+
+
+def describe_change_overall(crime_cube, year_min, year_max, report=None):
+
+    crime_data = calculate_change_overall(crime_cube, year_min, year_max)
+    add_to_report(report, crime_data)
+
+
+def calculate_change_overall(crime_cube, year_min, year_max):
+
+    '''
+    Count incidents by year and their change from the first year to the last.
+    Years without incidents, i.e. outside of a time window, count none, and
+    change from a year without incidents is missing.
+
+    crime_cube (DataFrame): incidents by year, among other dimensions.
+    year_min (int): lower-bound inclusive year.
+    year_max (int): upper-bound inclusive year.
+
+    Return incidents by year, then change (DataFrame).
+
+    '''
+
+    crime_data = crime_cube \
+        .groupby("year", observed=True)["incidents"] \
+        .sum()
+    crime_data = crime_data \
+        .reindex(crime_data.index.union(range(year_min, year_max + 1)), \
+            fill_value=0)
+    change = np.nan
+    if crime_data[year_min]:
+        change = (crime_data[year_max] - crime_data[year_min]) \
+            / crime_data[year_min]
+    crime_data = pd.concat([
+        crime_data,
+        pd.Series([change], index=["change"])])
+    crime_data = crime_data \
+        .reset_index()
+    crime_data.columns = ["year", "incidents"]
+    return crime_data
+
+
+def describe_change_in_variable(crime_cube, year_min, year_max, variable, \
+    report=None):
+
+    crime_data = calculate_change_in_variable(crime_cube, year_min, year_max, \
+        variable)
+    add_to_report(report, crime_data)
+
+
+def calculate_change_in_variable(crime_cube, year_min, year_max, variable):
+
+    '''
+    Count incidents by year for each value of a variable and their change from
+    the first year to the last, from most increased to most decreased. Years
+    without incidents of a value count none, and change from none is counted
+    as none.
+
+    crime_cube (DataFrame): incidents by year and variable, among others.
+    year_min (int): lower-bound inclusive year.
+    year_max (int): upper-bound inclusive year.
+    variable (str): dimension of the cube, i.e. primary_type.
+
+    Return incidents by variable and year, with change (DataFrame).
+
+    '''
+
+    crime_data = crime_cube \
+        .groupby(["year", variable], observed=True)["incidents"] \
+        .sum() \
+        .unstack(0, fill_value=0)
+    years = crime_data.columns.union(range(year_min, year_max + 1))
+    crime_data = crime_data \
+        .reindex(columns=years, fill_value=0) \
+        .reset_index()
+    crime_data["change"] = (crime_data[year_max] - crime_data[year_min]) \
+        / crime_data[year_min].where(crime_data[year_min] > 0)
+    crime_data = crime_data \
+        .fillna(dict.fromkeys(crime_data.columns.drop(variable), 0)) \
+        .sort_values(by="change", ascending=False)
+    return crime_data
+
+
+def plot_trends_of_crime_incidence(crime_cube, year_min, year_max, crimes, \
+    max_workers=None, skip_unchanged=True):
+
+    '''
+    Plot the weekly incidence of some crimes, one graph each. Weekly counts
+    of every crime come from one matrix, graphs render concurrently in
+    separate processes, and a graph whose counts have not changed since it
+    was last rendered is kept as is.
+
+    crime_cube (DataFrame): incidents by week and primary type.
+    year_min (int): lower-bound inclusive year.
+    year_max (int): upper-bound inclusive year.
+    crimes (lst): primary types of the crimes.
+    max_workers (int): number of processes rendering at once, or all cores.
+    skip_unchanged (bool): whether to keep graphs whose counts are unchanged.
+
+    Return paths of the graphs (lst).
+
+    '''
+
+    weekly = calculate_weekly_incidence(crime_cube)
+    manifest = {}
+    if os.path.exists(PLOT_MANIFEST):
+        with open(PLOT_MANIFEST) as f:
+            manifest = json.load(f)
+    paths, pending = [], []
+    for crime in crimes:
+        series = weekly.get(crime.upper(), pd.Series(0, index=weekly.index))
+        path = "-".join(
+            ["chicago", "-".join(crime.split()), str(year_min), str(year_max)]) \
+            + ".png"
+        digest = hashlib.sha1(crime.encode())
+        digest.update(pd.util.hash_pandas_object(series).to_numpy().tobytes())
+        paths.append(path)
+        if skip_unchanged and os.path.exists(path) \
+            and manifest.get(path) == digest.hexdigest():
+            continue
+        manifest[path] = digest.hexdigest()
+        pending.append((series.rename(None), crime, path))
+    if pending:
+        with ProcessPoolExecutor(max_workers=max_workers, \
+            initializer=matplotlib.use, initargs=("Agg",)) as executor:
+            list(executor.map(render_trend_of_crime_incidence, *zip(*pending)))
+        with open(PLOT_MANIFEST, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+    return paths
+
+
+def calculate_weekly_incidence(crime_cube):
+
+    '''
+    Count incidents of every crime by week, including weeks without any.
+
+    crime_cube (DataFrame): incidents by week and primary type.
+
+    Return incidents by week and primary type (DataFrame).
+
+    '''
+
+    weekly = crime_cube \
+        .groupby([pd.Grouper(key="week", freq="W-MON"), "primary_type"], \
+            observed=True)["incidents"] \
+        .sum() \
+        .unstack(fill_value=0) \
+        .asfreq("W-MON", fill_value=0)
+    weekly.columns = weekly.columns.astype(object)
+    return weekly
+
+
+def render_trend_of_crime_incidence(series, crime, path):
+
+    '''
+    Render the weekly incidence of one crime to a graph and close it.
+
+    series (Series): incidents by week.
+    crime (str): primary type of the crime.
+    path (str): location of the graph.
+
+    Return None.
+
+    '''
+
+    figure, axes = plt.subplots()
+    series.plot(ax=axes)
+    axes.set(
+        xlabel="Date",
+        ylabel="Incidence",
+        title=crime.title())
+    figure.savefig(path)
+    plt.close(figure)
+
+
+def describe_blocks_with_most_crime(crime_cube, census_data, year_min, year_max, crime, k_most, \
+    report=None):
+
+    ranked_blocks = rank_blocks_by_crime(crime_cube, census_data, year_min, \
+        year_max, crime, k_most)
+    for k, (_, kth_block) in enumerate(ranked_blocks.iterrows()):
+        add_to_report(report,
+            "\n" + str(kth_block["community"]).title() + ", block no. " + 
+            str(kth_block["block_group"]) + ":\n\n"
+            "    Ranked no. " + str(k + 1) + " for most CPD responses to " +
+            "incidents of " + crime.lower() + " in " + str(year_max) + ":\n" + 
+            "    " + str(year_max) + ": " + str(kth_block[year_max]) + "\n" +
+            "    " + str(year_min) + ": " + str(kth_block[year_min]) + "\n\n" +
+            "    Groups most represented in ACS statistics for this block:")
+        kth_block = kth_block \
+            .drop(["block_group", "community"]) \
+            .astype(float) \
+            .sort_values(ascending=False)
+        indicators = get_top_block_census_indicators(kth_block, ACS_VARIABLES)
+        for indicator, percent in indicators:
+            add_to_report(report,
+                "    " + indicator + ": " + str(np.round(percent * 100, 2)) + "%")
+        add_to_report(report, "\n")
+
+
+def rank_blocks_by_crime(crime_cube, census_data, year_min, year_max, crime, \
+    k_most):
+
+    '''
+    Rank the k block groups with the most incidents of a crime in the last
+    year. Counts by block group are taken once, the top k are selected by
+    partition rather than by sorting every block group, and only those k are
+    joined with their community areas and demographic profiles.
+
+    crime_cube (DataFrame): incidents by year, primary type, community area,
+    and block group.
+    census_data (DataFrame): census data indexed by vintage and block group.
+    year_min (int): lower-bound inclusive year.
+    year_max (int): upper-bound inclusive year, on which to rank.
+    crime (str): primary type of the crime.
+    k_most (int): number of block groups to rank.
+
+    Return ranked block groups with their counts by year, community area, and
+    demographic profile (DataFrame).
+
+    '''
+
+    crime_cube = crime_cube[crime_cube["primary_type"] == crime.upper()]
+    counts = crime_cube \
+        .groupby(["year", "block_group"], observed=True)["incidents"] \
+        .sum() \
+        .unstack(0)
+    counts = counts.reindex(
+        columns=sorted(set(counts.columns).union([year_min, year_max])))
+    k_most = max(0, min(k_most, len(counts)))
+    latest = counts[year_max].fillna(-1).to_numpy()
+    top = np.argpartition(-latest, k_most - 1)[:k_most] if k_most else []
+    top = sorted(top, key=lambda i: (-latest[i], counts.index[i]))
+    ranked_blocks = counts \
+        .iloc[top] \
+        .reset_index()
+    communities = crime_cube[crime_cube["block_group"] \
+        .isin(ranked_blocks["block_group"])] \
+        .groupby(["block_group", "community"], observed=True)["incidents"] \
+        .sum() \
+        .reset_index() \
+        .sort_values(by="incidents", kind="mergesort") \
+        .drop_duplicates(subset="block_group", keep="last") \
+        .set_index("block_group")["community"]
+    ranked_blocks["community"] = communities \
+        .reindex(ranked_blocks["block_group"]) \
+        .to_numpy()
+    profiles = lookup_census_profiles(census_data, \
+        np.full(len(ranked_blocks), year_max), ranked_blocks["block_group"]) \
+        .reset_index(drop=True)
+    ranked_blocks = pd.concat([ranked_blocks, profiles], axis=1)
+    return ranked_blocks
+
+
+def get_top_block_census_indicators(block, variable_dicts):
+
+    indicators = []
+    for variable_dict in variable_dicts:
+        best_indicator = (None, None)
+        columns, _ = isolate_respondents_label(variable_dict.values())
+        for variable in columns:
+            loc = block.index.get_loc(variable)
+            if best_indicator[0] is None or loc < best_indicator[0]:
+                best_indicator = loc, variable
+        if best_indicator[0]:
+            indicators.append([
+                best_indicator[1],
+                block.iloc[best_indicator[0]]])
+    return indicators
+
+
+def calculate_probability_by_variable_value(crime_cube, variable, value, group, \
+    report=None):
+
+    prob_crime = tabulate_conditional_probability(crime_cube, variable, \
+        group, [value]) \
+        .drop(columns=variable)
+    add_to_report(report, prob_crime)
+
+
+def crosstab_crime_cube(crime_cube, variable, group):
+
+    '''
+    Count incidents in a cube by every pair of values of two of its
+    dimensions.
+
+    crime_cube (DataFrame): incidents by some dimensions.
+    variable (str): dimension whose values become columns.
+    group (str): dimension whose values become rows.
+
+    Return incidents by group and variable (DataFrame).
+
+    '''
+
+    counts = crime_cube \
+        .groupby([group, variable], observed=True)["incidents"] \
+        .sum() \
+        .unstack(fill_value=0)
+    counts.columns = counts.columns.astype(object)
+    return counts
+
+
+def calculate_conditional_probability(crime_cube, variable, group, \
+    values=None):
+
+    '''
+    Calculate the probability of each value of group given each value of
+    variable, i.e. P(community | primary_type) for every crime at once, by
+    dividing each column of a crosstab of counts by its sum.
+
+    crime_cube (DataFrame): incidents by some dimensions.
+    variable (str): dimension to condition on.
+    group (str): dimension whose distribution is desired.
+    values (lst): values of variable to condition on, or all if None.
+
+    Return probabilities by group and value of variable (DataFrame), with the
+    counts in attrs["incidents"].
+
+    '''
+
+    if values is not None:
+        crime_cube = crime_cube[crime_cube[variable].isin(values)]
+    counts = crosstab_crime_cube(crime_cube, variable, group)
+    if values is not None:
+        counts = counts.reindex(columns=values, fill_value=0)
+    totals = counts.sum(axis=0)
+    probabilities = counts / totals.where(totals > 0)
+    probabilities.attrs["incidents"] = counts
+    return probabilities
+
+
+def tabulate_conditional_probability(crime_cube, variable, group, values):
+
+    '''
+    List the probability of each value of group given each of some values of
+    variable, with the incidents behind it, from most to least probable
+    within each value. Values of group without incidents are left out.
+
+    crime_cube (DataFrame): incidents by some dimensions.
+    variable (str): dimension to condition on.
+    group (str): dimension whose distribution is desired.
+    values (lst): values of variable to condition on.
+
+    Return value of group, value of variable, incidents, probability
+    (DataFrame).
+
+    '''
+
+    probabilities = calculate_conditional_probability(crime_cube, variable, \
+        group, values)
+    counts = probabilities.attrs["incidents"]
+    prob_crime = pd.concat([
+        pd.DataFrame({
+            group: probabilities.index,
+            variable: value,
+            "incidents": counts[value].to_numpy(),
+            "probability": probabilities[value].to_numpy()}) \
+            .query("incidents > 0") \
+            .sort_values(by="probability", ascending=False)
+        for value in values],
+        ignore_index=True)
+    return prob_crime
+
+
+class CrimeReport:
+
+    '''
+    Report of the diagnostic: sections, each a title and a sequence of tables
+    and text, gathered as they are computed and rendered at the end to
+    Markdown or JSON.
+
+    '''
+
+    def __init__(self):
+
+        self.sections = [{"title": None, "items": []}]
+
+
+    def add_section(self, title):
+
+        '''
+        Start a section, to which later items are added.
+
+        title (str): title of the section.
+
+        Return None.
+
+        '''
+
+        self.sections.append({"title": title, "items": []})
+
+
+    def add(self, item):
+
+        '''
+        Add a table or text to the current section.
+
+        item (DataFrame or str): table or text.
+
+        Return None.
+
+        '''
+
+        self.sections[-1]["items"].append(item)
+
+
+    def to_markdown(self):
+
+        '''
+        Render the report to Markdown, tables in tabulate's simple format.
+
+        Return report (str).
+
+        '''
+
+        lines = []
+        for section in self.sections:
+            if section["title"] is not None:
+                lines.append("#### " + section["title"] + "\n")
+            lines.extend(render_report_item(item) for item in section["items"])
+        return "".join(line + "\n" for line in lines)
+
+
+    def to_json(self):
+
+        '''
+        Render the report to JSON, tables as lists of records. Blank text
+        that only spaces the Markdown out is left out.
+
+        Return report (str).
+
+        '''
+
+        sections = [
+            {"title": section["title"], "items": [
+                {"table": json.loads(item.to_json(orient="records", \
+                    date_format="iso"))}
+                if isinstance(item, pd.DataFrame) else {"text": item.strip()}
+                for item in section["items"]
+                if isinstance(item, pd.DataFrame) or item.strip()]}
+            for section in self.sections
+            if section["title"] is not None or section["items"]]
+        return json.dumps({"sections": sections}, indent=2)
+
+
+def render_report_item(item):
+
+    '''
+    Render a table or text of a report as it prints.
+
+    item (DataFrame or str): table or text.
+
+    Return item (str).
+
+    '''
+
+    if isinstance(item, pd.DataFrame):
+        return tabulate(item, headers="keys", tablefmt="simple", \
+            showindex="never")
+    return item
+
+
+def add_to_report(report, item):
+
+    '''
+    Add a table or text to a report, or print it if there is no report.
+
+    report (CrimeReport): report to add to, or None to print.
+    item (DataFrame or str): table or text.
+
+    Return None.
+
+    '''
+
+    if report is None:
+        print(render_report_item(item))
+    else:
+        report.add(item)
+
+
+class PipelineTrace:
+
+    '''
+    Record the stages of one run: elapsed time, rows in and out, bytes
+    downloaded, HTTP requests, and change in resident memory of each. Stages
+    nest, so a stage's measures include those of the stages inside it.
+    Requests from worker threads count toward every stage open at the time.
+
+    '''
+
+    def __init__(self):
+
+        self.stages = []
+        self.requests = 0
+        self.bytes_downloaded = 0
+        self.started = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._tallies = {}
+
+
+    @contextmanager
+    def stage(self, name, rows_in=None, tally=False):
+
+        '''
+        Measure one stage of the run. A tallied stage is measured each time
+        it opens under the same parent, but recorded once with the sums, i.e.
+        for work done page by page.
+
+        name (str): name of the stage.
+        rows_in (int): number of rows the stage receives, if known.
+        tally (bool): whether to sum every call into one record.
+
+        Yield measures of this call (dict), whose "rows_out" the stage sets.
+
+        '''
+
+        stack = self._local.__dict__.setdefault("stack", [])
+        parent = stack[-1]["index"] if stack else None
+        record = self._tallies.get((parent, name)) if tally else None
+        if record is None:
+            with self._lock:
+                record = {
+                    "index": len(self.stages),
+                    "parent": parent,
+                    "depth": len(stack),
+                    "stage": name,
+                    "calls": 0,
+                    "rows_in": None,
+                    "rows_out": None,
+                    "seconds": 0.0,
+                    "requests": 0,
+                    "bytes_downloaded": 0,
+                    "memory_delta_mb": 0.0}
+                self.stages.append(record)
+            if tally:
+                self._tallies[(parent, name)] = record
+        measures = {"rows_out": None}
+        with self._lock:
+            requests_before = self.requests
+            bytes_before = self.bytes_downloaded
+        memory_before = measure_memory()
+        start = time.perf_counter()
+        stack.append(record)
+        try:
+            yield measures
+        finally:
+            stack.pop()
+            record["calls"] += 1
+            record["seconds"] += time.perf_counter() - start
+            record["requests"] += self.requests - requests_before
+            record["bytes_downloaded"] += self.bytes_downloaded - bytes_before
+            record["memory_delta_mb"] += \
+                (measure_memory() - memory_before) / 2 ** 20
+            for rows, count in [("rows_in", rows_in), \
+                ("rows_out", measures["rows_out"])]:
+                if count is not None:
+                    record[rows] = (record[rows] or 0) + int(count)
+
+
+    def count_request(self, response):
+
+        '''
+        Count one HTTP response and the bytes of its body, unless it was
+        replayed from a recording rather than downloaded.
+
+        response (Response): response to a request.
+
+        Return None.
+
+        '''
+
+        with self._lock:
+            self.requests += 1
+            if not getattr(response, "from_recording", False):
+                self.bytes_downloaded += len(response.content)
+
+
+    def save(self, path, allocations=None):
+
+        '''
+        Save the trace as JSON.
+
+        path (str): location of the trace.
+        allocations (lst): largest allocations by line, if traced.
+
+        Return None.
+
+        '''
+
+        trace = {
+            "started": self.started,
+            "requests": self.requests,
+            "bytes_downloaded": self.bytes_downloaded,
+            "stages": self.stages}
+        if allocations is not None:
+            trace["allocations"] = allocations
+        with open(path, "w") as f:
+            json.dump(trace, f, indent=2)
+
+
+    def summarize(self):
+
+        '''
+        Tabulate the stages of the run, indented by their nesting.
+
+        Return table (str).
+
+        '''
+
+        columns = [
+            "stage", "calls", "rows_in", "rows_out", "seconds", "requests",
+            "bytes_downloaded", "memory_delta_mb"]
+        stages = [
+            ["· " * record["depth"] + record["stage"]] +
+            [record[column] for column in columns[1:]]
+            for record in self.stages]
+        return tabulate(stages, headers=columns, tablefmt="simple", \
+            floatfmt=".3f")
+
+
+PIPELINE_TRACE = PipelineTrace()
+
+
+def measure_memory():
+
+    '''
+    Measure the resident memory of this process, or its peak where the
+    current size is unavailable.
+
+    Return bytes (int).
+
+    '''
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def list_largest_allocations(limit=20):
+
+    '''
+    List the lines that hold the most memory traced by tracemalloc.
+
+    limit (int): number of lines to list.
+
+    Return allocations (lst of dict).
+
+    '''
+
+    statistics = tracemalloc.take_snapshot().statistics("lineno")[:limit]
+    allocations = [
+        {"line": str(statistic.traceback[0]),
+            "size_mb": statistic.size / 2 ** 20,
+            "count": statistic.count}
+        for statistic in statistics]
+    return allocations
+
+
+def parse_crimes(crimes):
+
+    '''
+    Parse a comma delimited list of crimes whose names may hold spaces.
+
+    crimes (lst): command line arguments, i.e. "battery," "sex" "offense".
+
+    Return crimes (lst).
+
+    '''
+
+    crimes = " ".join(crimes).split(",")
+    return [crime.strip() for crime in crimes if crime.strip()]
+
+
+def build_cli_parser():
+
+    '''
+    Build the parser of the command line, with a subcommand for each stage.
+
+    Return parser (ArgumentParser).
+
+    '''
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("year_min", type=int, help="inclusive lower bound year")
+    common.add_argument("year_max", type=int, help="inclusive upper bound year")
+    common.add_argument(
+        "--trace", metavar="PATH",
+        help="save the time, rows, bytes, requests, and memory of each stage "
+            "as JSON")
+    common.add_argument(
+        "--profile", metavar="PATH", help="save a cProfile of the run")
+    common.add_argument(
+        "--tracemalloc", action="store_true",
+        help="trace allocations into the trace")
+    common.add_argument(
+        "--source", default="live",
+        help="where data comes from: live APIs, record:<dir> to record their "
+            "responses, replay:<dir> to replay them without the network, or "
+            "snapshot:<dir> to restore saved caches into the working directory "
+            "and run from them. Requests depend on the caches, so replay from "
+            "the caches recorded from, i.e. an empty directory or a snapshot "
+            "saved then")
+    common.add_argument(
+        "--replace-caches", action="store_true",
+        help="let snapshot:<dir> replace caches of the working directory "
+            "that differ from it")
+    cached = argparse.ArgumentParser(add_help=False)
+    cached.add_argument(
+        "--demo", action="store_true",
+        help="run in demo mode from existing cached files")
+    crimes = argparse.ArgumentParser(add_help=False)
+    crimes.add_argument(
+        "crimes", nargs="+", help="comma delimited crimes")
+    k_most = argparse.ArgumentParser(add_help=False)
+    k_most.add_argument(
+        "--k-most", type=int, default=3,
+        help="number of highest-incidence blocks to report")
+    workers = argparse.ArgumentParser(add_help=False)
+    workers.add_argument(
+        "--workers", type=int, default=1,
+        help="number of processes counting incidents by primary type and "
+            "year, or 0 for all cores")
+    workers.add_argument(
+        "--out-of-core", action="store_true",
+        help="count the crime store one monthly partition at a time, to "
+            "report on many years in bounded memory")
+    saved = argparse.ArgumentParser(add_help=False)
+    saved.add_argument(
+        "--json", metavar="PATH", help="save the report as JSON")
+    parser = argparse.ArgumentParser(
+        description="Diagnostic of crime in Chicago.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser(
+        "summarize", parents=[common, crimes, k_most, cached, workers, saved],
+        help="run every stage and report")
+    fetch = commands.add_parser(
+        "fetch", parents=[common],
+        help="update geometries, the crime store, and ACS caches")
+    fetch.add_argument(
+        "--rebuild-geometry", action="store_true",
+        help="request and dissolve geometries again even if the bundle is "
+            "current")
+    fetch.add_argument(
+        "--save-snapshot", metavar="DIR",
+        help="save the caches as a snapshot once they are up to date")
+    commands.add_parser(
+        "join", parents=[common],
+        help="locate the crime store among current geometries")
+    commands.add_parser(
+        "report", parents=[common, crimes, k_most, cached, workers, saved],
+        help="report statistics without plotting")
+    commands.add_parser(
+        "plot", parents=[common, crimes, cached, workers],
+        help="plot trends of crime incidence")
+    return parser
+
+
+def run_cli_command(arguments):
+
+    '''
+    Run the stage of a subcommand.
+
+    arguments (Namespace): parsed command line.
+
+    Return None.
+
+    '''
+
+    if arguments.command == "fetch":
+        num_records = update_crime_caches(arguments.year_min, \
+            arguments.year_max, arguments.rebuild_geometry)
+        print("Upserted " + str(num_records) + " records.")
+        if arguments.save_snapshot:
+            SnapshotSource(arguments.save_snapshot).save()
+    elif arguments.command == "join":
+        located = join_crime_caches(arguments.year_min, arguments.year_max)
         print(
-            "Expected a string for the third argument:\n"
-            "  3. comma delimited crimes.")
-    crimes = crimes.split(",")
-    crimes = [crime.lstrip() for crime in crimes]
-    summarize_crime(year_min, year_max, crimes, k_most, demo)
+            tabulate(located, headers="keys", tablefmt="simple", showindex="never"))
+    else:
+        crime_report = summarize_crime(
+            arguments.year_min, arguments.year_max,
+            parse_crimes(arguments.crimes), getattr(arguments, "k_most", None),
+            arguments.demo,
+            report=arguments.command != "plot",
+            plot=arguments.command != "report",
+            max_workers=arguments.workers or None,
+            out_of_core=arguments.out_of_core)
+        if getattr(arguments, "json", None):
+            with open(arguments.json, "w") as f:
+                f.write(crime_report.to_json())
+
+
+def run():
+
+    parser = build_cli_parser()
+    arguments = parser.parse_args()
+    if arguments.year_min > arguments.year_max:
+        print("Expected year_min no later than year_max.")
+        sys.exit(2)
+    try:
+        source = open_data_source(arguments.source)
+    except ValueError as error:
+        parser.error(str(error))
+    if isinstance(source, SnapshotSource):
+        source.restore(arguments.replace_caches)
+        arguments.demo = True
+    set_data_source(source)
+    if arguments.tracemalloc:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if arguments.profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        run_cli_command(arguments)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(arguments.profile)
+        print(PIPELINE_TRACE.summarize(), file=sys.stderr)
+        if arguments.trace:
+            PIPELINE_TRACE.save(arguments.trace, \
+                list_largest_allocations() if arguments.tracemalloc else None)
     print(
         "Finished!")
 
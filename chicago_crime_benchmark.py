@@ -0,0 +1,375 @@
+'''
+Benchmarks: Crime in Chicago
+Assignment no. 1
+Machine Learning for Public Policy
+
+Time the stages of the diagnostic on synthetic data at the scale of Chicago:
+block groups tile the city's bounding box, and incidents fall among them at
+random. Each stage runs in a fresh process so that its peak memory is its
+own. Results are saved as JSON to compare versions offline.
+
+'''
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+import chicago_crime as cc
+
+CHICAGO_BOUNDS = (-87.94, 41.64, -87.52, 42.02)
+NUM_BLOCK_GROUPS = 48 * 48
+NUM_COMMUNITIES = 77
+NUM_CRIMES = 30
+BENCHMARK_SIZES = [100000, 1000000, 5000000]
+BENCHMARK_OUTPUT = "chicago-crime-benchmark.json"
+BENCHMARK_SEED = 2019
+
+STAGES = [
+    "join_crime_with_block_groups",
+    "merge_census_themes",
+    "build_crime_cubes",
+    "describe_change_in_variable",
+    "describe_blocks_with_most_crime",
+    "calculate_probability_by_variable_value"]
+
+
+def benchmark(sizes=BENCHMARK_SIZES, stages=STAGES, seed=BENCHMARK_SEED, \
+    output=BENCHMARK_OUTPUT):
+
+    '''
+    Run every stage at every size, each in a fresh process, and save the
+    results with enough context to compare them across versions.
+
+    sizes (lst): numbers of incidents to generate.
+    stages (lst): names of the stages to run.
+    seed (int): seed of the synthetic data.
+    output (str): location of the results.
+
+    Return results (dict).
+
+    '''
+
+    results = {
+        "commit": describe_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "libraries": {
+            "geopandas": gpd.__version__,
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "shapely": shapely.__version__},
+        "stages": []}
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        for stage in stages:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) \
+                as executor:
+                result = executor.submit(run_stage, stage, size, seed).result()
+            print(
+                stage + " (" + str(size) + " incidents): " +
+                str(np.round(result["seconds"], 3)) + " s, " +
+                str(int(result["rows_per_second"])) + " rows/s, " +
+                str(np.round(result["peak_rss_mb"], 1)) + " MB peak",
+                file=sys.stderr)
+            results["stages"].append(result)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    return results
+
+
+def run_stage(stage, size, seed=BENCHMARK_SEED):
+
+    '''
+    Generate the synthetic data, then time one stage and measure the peak
+    memory of the process while it runs. Its rate counts the rows the stage
+    reads, i.e. block groups of ACS themes rather than incidents where it
+    reads no incidents.
+
+    stage (str): name of the stage.
+    size (int): number of incidents to generate.
+    seed (int): seed of the synthetic data.
+
+    Return result (dict).
+
+    '''
+
+    fixture = build_fixture(size, seed)
+    run = globals()["run_" + stage]
+    prepared = run(fixture, prepare=True)
+    reset_peak_rss()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows = run(fixture, prepared=prepared)
+    seconds = time.perf_counter() - start
+    result = {
+        "stage": stage,
+        "incidents": size,
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds else float("inf"),
+        "peak_rss_mb": read_peak_rss() / 2 ** 20}
+    return result
+
+
+def build_fixture(size, seed=BENCHMARK_SEED):
+
+    '''
+    Generate block groups that tile Chicago's bounding box, community areas
+    that group them, incidents among them, and ACS themes for them.
+
+    size (int): number of incidents to generate.
+    seed (int): seed of the synthetic data.
+
+    Return fixture (dict).
+
+    '''
+
+    random = np.random.default_rng(seed)
+    blocks = build_block_groups()
+    block_groups = blocks["block_group"].to_numpy()
+    communities = np.array(
+        ["COMMUNITY " + str(i) for i in range(NUM_COMMUNITIES)], dtype=object)
+    community_of_block = random.integers(0, NUM_COMMUNITIES, len(blocks))
+    x_min, y_min, x_max, y_max = CHICAGO_BOUNDS
+    longitude = random.uniform(x_min, x_max, size)
+    latitude = random.uniform(y_min, y_max, size)
+    cells = int(np.sqrt(NUM_BLOCK_GROUPS))
+    column = np.minimum(((longitude - x_min) / (x_max - x_min) * cells) \
+        .astype(int), cells - 1)
+    row = np.minimum(((latitude - y_min) / (y_max - y_min) * cells) \
+        .astype(int), cells - 1)
+    block = row * cells + column
+    date = pd.Timestamp("2017-01-01") + pd.to_timedelta(
+        random.integers(0, 2 * 365 * 24 * 60, size), unit="min")
+    crimes = np.array(
+        ["CRIME " + str(i) for i in range(NUM_CRIMES)], dtype=object)
+    # Crimes and places are skewed like the real feed: a few dominate.
+    crime = random.zipf(1.5, size) % NUM_CRIMES
+    crime_data = pd.DataFrame({
+        "id": np.arange(size),
+        "date": date.normalize(),
+        "year": date.year.astype(np.int16),
+        "primary_type": crimes[crime],
+        "block": (block * 10 + random.integers(0, 10, size)).astype(str),
+        "community": communities[community_of_block[block]],
+        "block_group": block_groups[block],
+        "longitude": longitude,
+        "latitude": latitude})
+    crime_data = cc.compact_crime_data(crime_data)
+    fixture = {
+        "blocks": blocks,
+        "crime_data": crime_data,
+        "themes": build_census_themes(block_groups, random)}
+    return fixture
+
+
+def build_block_groups():
+
+    '''
+    Tile Chicago's bounding box with square block groups.
+
+    Return block groups data (GeoDataFrame).
+
+    '''
+
+    x_min, y_min, x_max, y_max = CHICAGO_BOUNDS
+    cells = int(np.sqrt(NUM_BLOCK_GROUPS))
+    x = np.linspace(x_min, x_max, cells + 1)
+    y = np.linspace(y_min, y_max, cells + 1)
+    column, row = np.meshgrid(np.arange(cells), np.arange(cells))
+    column, row = column.ravel(), row.ravel()
+    geometries = shapely.box(x[column], y[row], x[column + 1], y[row + 1])
+    blocks = gpd.GeoDataFrame({
+        "block_group": ["17031" + str(i).zfill(7) for i in range(len(row))],
+        "the_geom": geometries}) \
+        .set_geometry("the_geom")
+    return blocks
+
+
+def build_census_themes(block_groups, random):
+
+    '''
+    Generate ACS themes for block groups in every vintage, normalized like
+    those requested from the Census Bureau.
+
+    block_groups (array): block groups.
+    random (Generator): source of random numbers.
+
+    Return themes (lst of DataFrame) by vintage (dict).
+
+    '''
+
+    themes = {}
+    for vintage in cc.ACS_VINTAGES:
+        themes[vintage] = []
+        for variable_dict in cc.ACS_VARIABLES:
+            columns, respondents = cc.isolate_respondents_label(
+                variable_dict.values())
+            theme = pd.DataFrame(
+                random.dirichlet(np.ones(len(columns)), len(block_groups)),
+                columns=columns)
+            theme[respondents] = random.integers(
+                100, 3000, len(block_groups)).astype(float)
+            theme.insert(0, "block_group", block_groups)
+            themes[vintage].append(theme)
+    return themes
+
+
+def run_join_crime_with_block_groups(fixture, prepare=False, prepared=None):
+
+    if prepare:
+        return cc.build_block_group_index(fixture["blocks"])
+    cc.join_crime_with_block_groups(
+        fixture["crime_data"][["block", "longitude", "latitude"]],
+        fixture["blocks"], block_index=prepared)
+    return len(fixture["crime_data"])
+
+
+def run_merge_census_themes(fixture, prepare=False, prepared=None):
+
+    if prepare:
+        return None
+    cc.merge_census_themes(fixture["themes"])
+    return sum(
+        len(theme) for themes in fixture["themes"].values() for theme in themes)
+
+
+def run_build_crime_cubes(fixture, prepare=False, prepared=None):
+
+    if prepare:
+        return None
+    cc.build_crime_cubes(fixture["crime_data"])
+    return len(fixture["crime_data"])
+
+
+def run_describe_change_in_variable(fixture, prepare=False, prepared=None):
+
+    if prepare:
+        return cc.build_crime_cubes(fixture["crime_data"])
+    for variable in ["primary_type", "community"]:
+        cc.describe_change_in_variable(prepared["months"], 2017, 2018, variable)
+    return 2 * len(prepared["months"])
+
+
+def run_describe_blocks_with_most_crime(fixture, prepare=False, prepared=None):
+
+    if prepare:
+        return cc.build_crime_cubes(fixture["crime_data"]), \
+            cc.merge_census_themes(fixture["themes"])
+    crime_cubes, census_data = prepared
+    for crime in ["CRIME 1", "CRIME 2", "CRIME 3"]:
+        cc.describe_blocks_with_most_crime(crime_cubes["blocks"], census_data, \
+            2017, 2018, crime, 10)
+    return 3 * len(crime_cubes["blocks"])
+
+
+def run_calculate_probability_by_variable_value(fixture, prepare=False, \
+    prepared=None):
+
+    if prepare:
+        return cc.build_crime_cubes(fixture["crime_data"])
+    block_group = fixture["blocks"]["block_group"].iloc[0]
+    cc.calculate_probability_by_variable_value(prepared["blocks"], \
+        "block_group", block_group, "primary_type")
+    cc.calculate_probability_by_variable_value(prepared["blocks"], \
+        "primary_type", "CRIME 1", "community")
+    return 2 * len(prepared["blocks"])
+
+
+def reset_peak_rss():
+
+    '''
+    Reset the peak resident memory of this process where the system allows,
+    so that the peak read next belongs to the stage alone.
+
+    Return None.
+
+    '''
+
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def read_peak_rss():
+
+    '''
+    Read the peak resident memory of this process since the last reset, or
+    since it started where resets are not allowed.
+
+    Return bytes (int).
+
+    '''
+
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def describe_commit():
+
+    '''
+    Describe the commit of the code benchmarked, if it is in a git repository.
+
+    Return commit (str), or None if unknown.
+
+    '''
+
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run():
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the stages of the diagnostic on synthetic data.")
+    parser.add_argument(
+        "--sizes", default=",".join(str(size) for size in BENCHMARK_SIZES),
+        help="comma delimited numbers of incidents")
+    parser.add_argument(
+        "--stages", default=",".join(STAGES),
+        help="comma delimited stages among: " + ", ".join(STAGES))
+    parser.add_argument(
+        "--seed", type=int, default=BENCHMARK_SEED,
+        help="seed of the synthetic data")
+    parser.add_argument(
+        "--output", default=BENCHMARK_OUTPUT,
+        help="location of the results as JSON")
+    arguments = parser.parse_args()
+    stages = arguments.stages.split(",")
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error("unknown stage: " + stage)
+    benchmark(
+        [int(size) for size in arguments.sizes.split(",")],
+        stages, arguments.seed, arguments.output)
+
+
+if __name__ == "__main__":
+    run()
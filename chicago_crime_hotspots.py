@@ -0,0 +1,234 @@
+'''
+Hotspots: Crime in Chicago
+Assignment no. 1
+Machine Learning for Public Policy
+
+Rank block groups by their rate of crime per resident and by how much crime
+their neighbors share, rather than by raw counts, where small, dense block
+groups dominate. Block groups that touch are neighbors, found once from the
+dissolved polygons into a sparse adjacency matrix, so that every crime of
+every block group is scored in one pass of sparse products.
+
+'''
+
+import argparse
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+from tabulate import tabulate
+import chicago_crime as cc
+
+HOTSPOT_RATE_SCALE = 1000 # incidents per this many residents
+HOTSPOT_MIN_POPULATION = 100
+HOTSPOT_MEASURES = ["incidents", "rate", "lagged_rate", "getis_ord"]
+
+
+def build_block_group_adjacency(block_index, tolerance=None):
+
+    '''
+    Find the block groups that share a boundary or corner with each other,
+    in one query of the spatial index.
+
+    block_index (BlockGroupIndex): spatial index over block groups.
+    tolerance (float): distance within which block groups count as neighbors,
+    to bridge slivers between simplified polygons, or None if they must touch.
+
+    Return adjacency of block groups, without themselves (csr_matrix).
+
+    '''
+
+    geometries = block_index.tree.geometries
+    if tolerance:
+        pairs = block_index.tree.query(geometries, predicate="dwithin", \
+            distance=tolerance)
+    else:
+        pairs = block_index.tree.query(geometries, predicate="intersects")
+    pairs = pairs[:, pairs[0] != pairs[1]]
+    adjacency = sparse.csr_matrix(
+        (np.ones(pairs.shape[1]), (pairs[0], pairs[1])),
+        shape=(len(geometries), len(geometries)))
+    adjacency.data[:] = 1
+    return adjacency
+
+
+def calculate_crime_rates(crime_cube, census_data, block_groups, year):
+
+    '''
+    Count incidents of every crime in every block group in a year, and rate
+    them per resident from the ACS vintage matched to the year. Block groups
+    with too few residents for a stable rate have none.
+
+    crime_cube (DataFrame): incidents by year, primary type, and block group.
+    census_data (DataFrame): census data indexed by vintage and block group.
+    block_groups (array): block groups, in the order of the adjacency.
+    year (int): year of the incidents.
+
+    Return incidents, residents, rates (tuple of DataFrame, Series, DataFrame).
+
+    '''
+
+    counts = cc.crosstab_crime_cube(crime_cube[crime_cube["year"] == year], \
+        "primary_type", "block_group") \
+        .reindex(index=block_groups, fill_value=0)
+    population = cc.lookup_census_profiles(census_data, \
+        np.full(len(block_groups), year), block_groups)["race_respondents"] \
+        .set_axis(counts.index)
+    stable = population.where(population >= HOTSPOT_MIN_POPULATION)
+    rates = counts \
+        .div(stable, axis=0) \
+        .mul(HOTSPOT_RATE_SCALE)
+    return counts, population, rates
+
+
+def calculate_spatial_lag(adjacency, values):
+
+    '''
+    Average the values of the neighbors of each block group. Neighbors
+    without a value are left out of the average.
+
+    adjacency (csr_matrix): adjacency of block groups, without themselves.
+    values (array): values of each block group, in columns.
+
+    Return lagged values (array).
+
+    '''
+
+    known = ~np.isnan(values)
+    totals = adjacency @ np.where(known, values, 0)
+    neighbors = adjacency @ known.astype(float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return totals / neighbors
+
+
+def calculate_getis_ord(adjacency, values):
+
+    '''
+    Score each block group by the Getis-Ord Gi* statistic: how far the sum of
+    its values and its neighbors' is from what the mean would give, in
+    standard errors. Block groups without a value take the mean, so that
+    they neither raise nor lower their neighbors' scores.
+
+    adjacency (csr_matrix): adjacency of block groups, without themselves.
+    values (array): values of each block group, in columns.
+
+    Return z-scores (array).
+
+    '''
+
+    num_blocks = values.shape[0]
+    means = np.nanmean(values, axis=0)
+    values = np.where(np.isnan(values), means, values)
+    deviations = np.sqrt(np.mean(values ** 2, axis=0) - means ** 2)
+    weights = adjacency + sparse.identity(num_blocks, format="csr")
+    weight_sums = np.asarray(weights.sum(axis=1))
+    weight_squares = np.asarray(weights.multiply(weights).sum(axis=1))
+    numerators = weights @ values - np.outer(weight_sums, means)
+    denominators = np.outer(
+        np.sqrt((num_blocks * weight_squares - weight_sums ** 2) \
+            / (num_blocks - 1)),
+        deviations)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return numerators / denominators
+
+
+def score_hotspots(crime_cube, census_data, block_index, year, \
+    adjacency=None):
+
+    '''
+    Score every block group for every crime in a year: incidents, rate per
+    residents, rate among neighbors, and Getis-Ord Gi* z-score of the rate.
+
+    crime_cube (DataFrame): incidents by year, primary type, and block group.
+    census_data (DataFrame): census data indexed by vintage and block group.
+    block_index (BlockGroupIndex): spatial index over block groups.
+    year (int): year of the incidents.
+    adjacency (csr_matrix): prebuilt adjacency of block groups, if any.
+
+    Return scores by block group and primary type (DataFrame).
+
+    '''
+
+    if adjacency is None:
+        adjacency = build_block_group_adjacency(block_index)
+    counts, population, rates = calculate_crime_rates(crime_cube, \
+        census_data, block_index.block_groups, year)
+    values = rates.to_numpy(dtype=float)
+    measures = {
+        "incidents": counts.to_numpy(),
+        "rate": values,
+        "lagged_rate": calculate_spatial_lag(adjacency, values),
+        "getis_ord": calculate_getis_ord(adjacency, values)}
+    scores = pd.DataFrame({
+        measure: matrix.ravel()
+        for measure, matrix in measures.items()},
+        index=pd.MultiIndex.from_product(
+            [counts.index, counts.columns],
+            names=["block_group", "primary_type"]))
+    scores["residents"] = np.repeat(population.to_numpy(), counts.shape[1])
+    return scores.reset_index()
+
+
+def rank_hotspots(scores, crime, k_most, by="getis_ord"):
+
+    '''
+    Rank the k block groups that score highest for a crime.
+
+    scores (DataFrame): scores by block group and primary type.
+    crime (str): primary type of the crime.
+    k_most (int): number of block groups to rank.
+    by (str): measure to rank on, among HOTSPOT_MEASURES.
+
+    Return ranked block groups with their scores (DataFrame).
+
+    '''
+
+    scores = scores[scores["primary_type"] == crime.upper()]
+    return scores \
+        .dropna(subset=[by]) \
+        .nlargest(k_most, by) \
+        .drop(columns="primary_type")
+
+
+def describe_hotspots(year_min, year_max, crimes, k_most, demo_from_csv=False, \
+    by="getis_ord", out_of_core=False):
+
+    analysis = cc.compile_crime_analysis(year_min, year_max, demo_from_csv, \
+        out_of_core=out_of_core)
+    scores = score_hotspots(analysis.crime_cubes["blocks"], \
+        analysis.census_data, analysis.block_index, year_max)
+    for crime in crimes:
+        print(
+            "#### " + crime.upper() + " hotspots in " + str(year_max) + "\n")
+        print(
+            tabulate(rank_hotspots(scores, crime, k_most, by), headers="keys", \
+                tablefmt="simple", showindex="never"))
+        print("\n")
+
+
+def run():
+
+    parser = argparse.ArgumentParser(
+        description="Rank block groups by rate and neighbor-aware scores.")
+    parser.add_argument("year_min", type=int, help="inclusive lower bound year")
+    parser.add_argument("year_max", type=int, help="inclusive upper bound year")
+    parser.add_argument("crimes", nargs="+", help="comma delimited crimes")
+    parser.add_argument(
+        "--k-most", type=int, default=10,
+        help="number of hotspots to report for each crime")
+    parser.add_argument(
+        "--by", choices=HOTSPOT_MEASURES, default="getis_ord",
+        help="measure to rank on")
+    parser.add_argument(
+        "--demo", action="store_true",
+        help="run in demo mode from existing cached files")
+    parser.add_argument(
+        "--out-of-core", action="store_true",
+        help="count the crime store one monthly partition at a time")
+    arguments = parser.parse_args()
+    describe_hotspots(arguments.year_min, arguments.year_max, \
+        cc.parse_crimes(arguments.crimes), arguments.k_most, arguments.demo, \
+        arguments.by, arguments.out_of_core)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,374 @@
+'''
+Server: Crime in Chicago
+Assignment no. 1
+Machine Learning for Public Policy
+
+Compile, join, and index the data of the diagnostic once, keep it in memory,
+and answer its questions as JSON over a local HTTP API:
+
+    GET /change?variable=primary_type&month=7&hour=22&hour=23
+    GET /blocks?crime=battery&k=3
+    GET /probability?variable=primary_type&value=THEFT&group=community
+    GET /trend?crime=battery&crime=homicide
+
+Answers are cached on their query parameters, so a dashboard that asks the
+same question again is answered without counting again.
+
+'''
+
+import argparse
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sys
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import chicago_crime as cc
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8050
+SERVER_CACHE_SIZE = 1024
+SERVER_K_MOST = 10
+
+ENDPOINTS = {
+    "/change": "incidents by year and their change, overall or by variable",
+    "/blocks": "block groups with the most incidents of a crime",
+    "/probability": "probability of each value of group given variable",
+    "/trend": "incidents of crimes by week"}
+
+
+class QueryError(ValueError):
+
+    '''
+    A query the server cannot answer as asked.
+
+    '''
+
+
+class CrimeAnalysisService:
+
+    '''
+    Answer the questions of the diagnostic from data compiled once. Answers
+    are serialized to JSON and cached on their endpoint and parameters.
+
+    '''
+
+    def __init__(self, analysis, cache_size=SERVER_CACHE_SIZE):
+
+        self.analysis = analysis
+        self.answer = lru_cache(maxsize=cache_size)(self._answer)
+
+
+    def query(self, path, params):
+
+        '''
+        Answer a query, from the cache if it was asked before.
+
+        path (str): endpoint of the query.
+        params (dict): values (lst) of each parameter.
+
+        Return answer as JSON (bytes).
+
+        '''
+
+        key = tuple(sorted((name, tuple(values)) \
+            for name, values in params.items()))
+        return self.answer(path, key)
+
+
+    def _answer(self, path, key):
+
+        '''
+        Answer a query by the method of its endpoint.
+
+        path (str): endpoint of the query.
+        key (tuple): names and values (tuple) of each parameter.
+
+        Return answer as JSON (bytes).
+
+        '''
+
+        params = {name: list(values) for name, values in key}
+        if path == "/":
+            return json.dumps({
+                "year_min": self.analysis.year_min,
+                "year_max": self.analysis.year_max,
+                "endpoints": ENDPOINTS}).encode()
+        answer = getattr(self, "answer_" + path.strip("/"))(params)
+        return answer.to_json(orient="records", date_format="iso").encode()
+
+
+    def answer_change(self, params):
+
+        '''
+        Count incidents by year and their change, overall or by the values of
+        a variable, optionally in a time window: between dates, in some
+        months of each year, on some days of the week, or at some hours.
+
+        params (dict): variable, start, end, month, weekday, hour, year_min,
+        year_max, if any. Months, days, and hours may repeat.
+
+        Return answer (DataFrame).
+
+        '''
+
+        crime_cube = self.analysis.crime_cubes["months"]
+        year_min, year_max = self.read_years(params)
+        window = read_time_window(params)
+        if any(bound is not None for bound in window):
+            if self.analysis.crime_data is None:
+                raise QueryError("time windows need crime data in memory, "
+                    "which the server compiled out of core")
+            crime_cube = cc.build_crime_cubes(self.analysis.crime_data, \
+                self.analysis.time_index, window)["months"]
+        variable = read_param(params, "variable")
+        if variable is None:
+            return cc.calculate_change_overall(crime_cube, year_min, year_max)
+        if variable not in ["primary_type", "community"]:
+            raise QueryError("variable must be primary_type or community")
+        return cc.calculate_change_in_variable(crime_cube, year_min, \
+            year_max, variable)
+
+
+    def answer_blocks(self, params):
+
+        '''
+        Rank the block groups with the most incidents of a crime in the last
+        year, with their demographic profiles.
+
+        params (dict): crime, k, year_min, year_max, if any.
+
+        Return answer (DataFrame).
+
+        '''
+
+        crime = read_param(params, "crime", required=True)
+        k_most = read_param(params, "k", int, SERVER_K_MOST)
+        if k_most < 0:
+            raise QueryError("k must not be negative")
+        year_min, year_max = self.read_years(params)
+        return cc.rank_blocks_by_crime(self.analysis.crime_cubes["blocks"], \
+            self.analysis.census_data, year_min, year_max, crime, k_most)
+
+
+    def answer_probability(self, params):
+
+        '''
+        List the probability of each value of group given each value of
+        variable asked.
+
+        params (dict): variable, value (one or more), group.
+
+        Return answer (DataFrame).
+
+        '''
+
+        crime_cube = self.analysis.crime_cubes["blocks"]
+        variable = read_param(params, "variable", required=True)
+        group = read_param(params, "group", required=True)
+        for dimension in [variable, group]:
+            if dimension not in crime_cube or dimension == "incidents":
+                raise QueryError("unknown dimension: " + dimension)
+        values = params.get("value")
+        if not values:
+            raise QueryError("expected at least one value")
+        if variable == "primary_type":
+            values = [value.upper() for value in values]
+        return cc.tabulate_conditional_probability(crime_cube, variable, \
+            group, values)
+
+
+    def answer_trend(self, params):
+
+        '''
+        Count incidents of some crimes by week.
+
+        params (dict): crime (one or more).
+
+        Return answer (DataFrame).
+
+        '''
+
+        crimes = [crime.upper() for crime in params.get("crime", [])]
+        if not crimes:
+            raise QueryError("expected at least one crime")
+        weekly = cc.calculate_weekly_incidence(
+            self.analysis.crime_cubes["weeks"])
+        return weekly \
+            .reindex(columns=crimes, fill_value=0) \
+            .rename_axis("week") \
+            .reset_index()
+
+
+    def read_years(self, params):
+
+        '''
+        Read the years to compare, by default the first and last compiled,
+        the first no later than the last.
+
+        params (dict): year_min, year_max, if any.
+
+        Return year_min, year_max (tuple).
+
+        '''
+
+        year_min = read_param(params, "year_min", int, self.analysis.year_min)
+        year_max = read_param(params, "year_max", int, self.analysis.year_max)
+        for year in [year_min, year_max]:
+            if not self.analysis.year_min <= year <= self.analysis.year_max:
+                raise QueryError("year outside of those compiled: " + str(year))
+        if year_min > year_max:
+            raise QueryError("year_min must be no later than year_max")
+        return year_min, year_max
+
+
+def read_param(params, name, cast=str, default=None, required=False):
+
+    '''
+    Read the first value of a query parameter.
+
+    params (dict): values (lst) of each parameter.
+    name (str): name of the parameter.
+    cast (type): type to cast the value to.
+    default (object): value if the parameter is absent.
+    required (bool): whether the parameter must be present.
+
+    Return value (object).
+
+    '''
+
+    values = params.get(name)
+    if not values:
+        if required:
+            raise QueryError("expected a value for " + name)
+        return default
+    try:
+        return cast(values[0])
+    except ValueError:
+        raise QueryError("expected " + cast.__name__ + " for " + name)
+
+
+def read_time_window(params):
+
+    '''
+    Read a time window from query parameters.
+
+    params (dict): values (lst) of each parameter.
+
+    Return time window (TimeWindow).
+
+    '''
+
+    bounds = {}
+    for name, field, low, high in [("month", "months", 1, 12), \
+        ("weekday", "weekdays", 0, 6), ("hour", "hours", 0, 23)]:
+        if name in params:
+            try:
+                values = [int(value) for value in params[name]]
+            except ValueError:
+                raise QueryError("expected int for " + name)
+            if not all(low <= value <= high for value in values):
+                raise QueryError(name + " must be from " + str(low) + " to " + \
+                    str(high))
+            bounds[field] = values
+    for name in ["start", "end"]:
+        value = read_param(params, name)
+        if value is not None:
+            try:
+                bounds[name] = np.datetime64(value)
+            except ValueError:
+                raise QueryError("expected a date for " + name)
+    return cc.TimeWindow(**bounds)
+
+
+class CrimeAnalysisHandler(BaseHTTPRequestHandler):
+
+    '''
+    Route GET requests to the service of the server.
+
+    '''
+
+    def do_GET(self):
+
+        url = urlsplit(self.path)
+        path = url.path.rstrip("/") or "/"
+        status = 200
+        try:
+            if path != "/" and path not in ENDPOINTS:
+                status = 404
+                raise QueryError("not found: " + path)
+            body = self.server.service.query(path, parse_qs(url.query))
+        except QueryError as error:
+            status = 400 if status == 200 else status
+            body = json.dumps({"error": str(error)}).encode()
+        except Exception as error:
+            status = 500
+            body = json.dumps({"error": repr(error)}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+
+        print(self.address_string() + " " + format % args, file=sys.stderr)
+
+
+def serve(year_min, year_max, demo_from_csv=False, host=SERVER_HOST, \
+    port=SERVER_PORT, out_of_core=False):
+
+    '''
+    Compile the data of the diagnostic, then answer queries until stopped.
+
+    year_min (int): lower-bound inclusive year.
+    year_max (int): upper-bound inclusive year.
+    demo_from_csv (bool): whether to compile from existing caches or update.
+    host (str): address to listen on.
+    port (int): port to listen on.
+    out_of_core (bool): whether to keep only the count cubes, not crime data.
+
+    Return None.
+
+    '''
+
+    analysis = cc.compile_crime_analysis(year_min, year_max, demo_from_csv, \
+        out_of_core=out_of_core)
+    server = ThreadingHTTPServer((host, port), CrimeAnalysisHandler)
+    server.service = CrimeAnalysisService(analysis)
+    print(
+        "Serving crime in Chicago from " + str(year_min) + " to " +
+        str(year_max) + " at http://" + host + ":" + str(server.server_port),
+        file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def run():
+
+    parser = argparse.ArgumentParser(
+        description="Answer the questions of the diagnostic over HTTP.")
+    parser.add_argument("year_min", type=int, help="inclusive lower bound year")
+    parser.add_argument("year_max", type=int, help="inclusive upper bound year")
+    parser.add_argument(
+        "--demo", action="store_true",
+        help="compile from existing cached files")
+    parser.add_argument("--host", default=SERVER_HOST, help="address to listen on")
+    parser.add_argument(
+        "--port", type=int, default=SERVER_PORT, help="port to listen on")
+    parser.add_argument(
+        "--out-of-core", action="store_true",
+        help="count the crime store one monthly partition at a time, without "
+            "time windows")
+    arguments = parser.parse_args()
+    serve(arguments.year_min, arguments.year_max, arguments.demo, \
+        arguments.host, arguments.port, arguments.out_of_core)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,53 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from chicago_crime import GeocodeCache
+
+
+class TestGeocodeCache(unittest.TestCase):
+
+    '''
+    Round trips of the geocode cache through disk.
+
+    '''
+
+    def test_save_and_reload(self):
+
+        '''
+        Entries learned and saved are found again, with their block groups,
+        once the cache is loaded anew.
+
+        '''
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = GeocodeCache(directory, version="v1")
+            cache.update_points(np.array([1, 2, 3], dtype=np.int64), \
+                ["170312801001", None, "170313301002"])
+            cache.update_blocks(np.array(["021XX S MICHIGAN AVE"] * 2 + \
+                ["001XX W MADISON ST"], dtype=object), \
+                np.array(["170313301002"] * 2 + ["170318391001"], \
+                dtype=object))
+            cache.save()
+
+            cache = GeocodeCache(directory, version="v1")
+            block_groups, found = cache.lookup_points(
+                np.array([1, 2, 3, 4], dtype=np.int64))
+            self.assertEqual(block_groups.tolist(), \
+                ["170312801001", None, "170313301002", None])
+            self.assertEqual(found.tolist(), [True, True, True, False])
+            block_groups, found = cache.lookup_blocks(np.array(
+                ["021XX S MICHIGAN AVE", "001XX W MADISON ST", "unknown"], \
+                dtype=object))
+            self.assertEqual(block_groups.tolist(), \
+                ["170313301002", "170318391001", None])
+            self.assertEqual(found.tolist(), [True, True, False])
+
+            cache = GeocodeCache(directory, version="v2")
+            _, found = cache.lookup_points(np.array([1], dtype=np.int64))
+            self.assertEqual(found.tolist(), [False])
+
+
+if __name__ == "__main__":
+    unittest.main()